@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# SCP-079-USER - Invite and help other bots
+# Copyright (C) 2019-2023 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-USER.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Run from the project directory: python -m benchmarks.compact_ids [count]
+
+import pickle
+import sys
+import tracemalloc
+from array import array
+from random import randint, sample, seed
+from time import perf_counter
+
+from plugins.functions.storage import CompactIdSet
+
+
+def get_size(factory, ids: array) -> (object, int):
+    # Build the container, return it with the memory allocated for it, including the int objects it keeps
+    tracemalloc.start()
+    container = factory(ids)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return container, size
+
+
+def get_lookup(container, probes: list, repeat: int = 5) -> float:
+    # Get the mean lookup time in nanoseconds, the best of some runs
+    result = float("inf")
+
+    for _ in range(repeat):
+        start = perf_counter()
+
+        for the_id in probes:
+            the_id in container
+
+        result = min(result, (perf_counter() - start) / len(probes) * 10 ** 9)
+
+    return result
+
+
+def main(count: int) -> None:
+    # Compare the plain set with the CompactIdSet
+    seed(79)
+    ids = array("q", [randint(10 ** 8, 7 * 10 ** 9) for _ in range(count)])
+    probes = sample(list(ids), 10000) + [randint(10 ** 8, 7 * 10 ** 9) for _ in range(10000)]
+
+    print(f"{count} ids, {len(probes)} lookups, half of them misses")
+    print(f"{'':<14}{'memory':>12}{'pickle':>12}{'dump ms':>10}{'load ms':>10}{'lookup ns':>12}")
+
+    for name, factory in [("set", set), ("CompactIdSet", CompactIdSet)]:
+        container, size = get_size(factory, ids)
+
+        start = perf_counter()
+        data = pickle.dumps(container, pickle.HIGHEST_PROTOCOL)
+        dump = (perf_counter() - start) * 1000
+
+        start = perf_counter()
+        pickle.loads(data)
+        load = (perf_counter() - start) * 1000
+
+        lookup = get_lookup(container, probes)
+
+        print(f"{name:<14}{size / 2 ** 20:>10.1f}MB{len(data) / 2 ** 20:>10.1f}MB{dump:>10.1f}{load:>10.1f}"
+              f"{lookup:>12.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
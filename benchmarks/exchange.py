@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# SCP-079-USER - Invite and help other bots
+# Copyright (C) 2019-2023 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-USER.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Run from the directory with config.ini: python -m benchmarks.exchange [count]
+
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps, loads
+from random import randrange, random, seed
+from threading import Lock
+from time import perf_counter, sleep
+from types import SimpleNamespace
+
+from plugins import glovar
+from plugins.functions.executor import BoundedExecutor
+from plugins.handlers import message
+
+
+class StubClient:
+    # A client whose every request takes 20 ms
+
+    def invoke(self, *args, **kwargs) -> None:
+        sleep(0.02)
+
+
+class OrderCheck:
+    # Record the last sequence number of each group, to check the per-group order
+
+    def __init__(self):
+        self.last = {}
+        self.kept = True
+
+    def record(self, data: dict) -> None:
+        gid, seq = data["group_id"], data["seq"]
+        self.kept = self.kept and self.last.get(gid, 0) < seq
+        self.last[gid] = seq
+
+
+def get_messages(count: int, groups: int = 50) -> list:
+    # Get the exchange messages, 10% help log and 90% declare
+    result = []
+    seqs = {}
+
+    for _ in range(count):
+        gid = -100 - randrange(groups)
+        seqs[gid] = seqs.get(gid, 0) + 1
+        action, action_type = ("help", "log") if random() < 0.1 else ("update", "declare")
+        text = dumps({"from": "CAPTCHA", "to": [glovar.sender], "action": action, "type": action_type,
+                      "data": {"group_id": gid, "seq": seqs[gid]}})
+        result.append(SimpleNamespace(text=text, caption=None))
+
+    return result
+
+
+def set_routes(check: OrderCheck, lock: bool) -> None:
+    # Replace the handlers of the benchmarked routes, help log makes three requests
+    def help_log(client: StubClient, data: dict) -> None:
+        for _ in range(3):
+            client.invoke()
+
+        check.record(data)
+
+    message.routes[("CAPTCHA", "help", "log")] = (help_log, ("client", "data"), lock)
+    message.routes[("CAPTCHA", "update", "declare")] = (check.record, ("data",), lock)
+
+
+def run_lock(client: StubClient, messages: list) -> None:
+    # The old path, parse and handle under the global lock in the handler workers
+    check = OrderCheck()
+    set_routes(check, False)
+    lock = Lock()
+
+    def process(msg: SimpleNamespace) -> None:
+        with lock:
+            data = loads(msg.text)
+            handler, arguments, _ = message.routes[(data["from"], data["action"], data["type"])]
+            handler(*[{"client": client, "data": data["data"]}[argument] for argument in arguments])
+
+    start = perf_counter()
+
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(process, messages))
+
+    elapsed = perf_counter() - start
+    print(f"{'global lock':<16}{len(messages) / elapsed:>8.0f} msg/s {elapsed:>8.2f} s")
+
+
+def run_shards(client: StubClient, messages: list, shards: int) -> None:
+    # Parse in one handler worker, handle in the receive shards
+    check = OrderCheck()
+    set_routes(check, False)
+    glovar.receive_executors = [BoundedExecutor(f"receive-{i}", 1, len(messages)) for i in range(shards)]
+    start = perf_counter()
+
+    for msg in messages:
+        message.process_data(client, msg)
+
+    while any(executor.stats["queued"] or executor.stats["running"] for executor in glovar.receive_executors):
+        sleep(0.005)
+
+    elapsed = perf_counter() - start
+
+    for executor in glovar.receive_executors:
+        executor.shutdown()
+
+    print(f"{f'{shards} shards':<16}{len(messages) / elapsed:>8.0f} msg/s {elapsed:>8.2f} s"
+          f"   order kept: {check.kept}")
+
+
+def main(count: int) -> None:
+    # Compare the global lock with the receive shards
+    seed(24)
+    client = StubClient()
+    messages = get_messages(count)
+
+    print(f"{count} exchange messages over 50 groups, 10% of them make three 20 ms requests")
+    run_lock(client, messages)
+
+    for shards in [8, 16]:
+        run_shards(client, messages, shards)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
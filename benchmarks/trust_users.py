@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# SCP-079-USER - Invite and help other bots
+# Copyright (C) 2019-2023 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-USER.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Run from the directory with config.ini: python -m benchmarks.trust_users [groups]
+
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from random import randrange, seed
+from time import perf_counter
+
+from plugins import glovar
+from plugins.functions.filters import is_class_e_user
+from plugins.functions.ids import remove_trust_group, set_trust_group
+from plugins.functions.storage import LazyData
+
+
+def get_trust_ids(groups: int, users: int = 8) -> dict:
+    # Get random trust lists
+    return {-100 - gid: {randrange(1, 200000) for _ in range(users)} for gid in range(groups)}
+
+
+def is_trusted(uid: int) -> bool:
+    # The old check, scan every group's trust list
+    for gid in list(glovar.trust_ids):
+        if uid in glovar.trust_ids.get(gid, set()):
+            return True
+
+    return False
+
+
+def run_churn(groups: int) -> None:
+    # Change the trust lists while the index is being built in background, as at startup
+    glovar.trust_ids = get_trust_ids(groups)
+
+    with ThreadPoolExecutor(1) as executor:
+        glovar.trust_users = LazyData(executor.submit(glovar.index_trust_ids, glovar.trust_ids))
+
+        # From the last groups, which the index reaches last
+        for gid in range(groups - 1, 0, -3):
+            set_trust_group(-100 - gid, {randrange(1, 200000) for _ in range(5)})
+
+        for gid in range(groups - 2, 0, -3):
+            remove_trust_group(-100 - gid)
+
+    matched = dict(glovar.trust_users) == glovar.index_trust_ids(glovar.trust_ids)
+    print(f"index matches a full rebuild after the changes: {matched}")
+
+
+def run_lookup(groups: int, count: int = 2000) -> None:
+    # Compare the full scan with the reverse index
+    glovar.trust_ids = get_trust_ids(groups)
+    glovar.trust_users = glovar.index_trust_ids(glovar.trust_ids)
+    uids = [randrange(1, 200000) for _ in range(count)]
+
+    start = perf_counter()
+    old = [is_trusted(uid) for uid in uids]
+    scan = (perf_counter() - start) / count * 10 ** 6
+
+    start = perf_counter()
+    new = [is_class_e_user(uid) for uid in uids]
+    index = (perf_counter() - start) / count * 10 ** 6
+
+    print(f"{groups} groups, {count} lookups, same answers: {old == new}")
+    print(f"{'full scan':<16}{scan:>10.2f} us per message")
+    print(f"{'reverse index':<16}{index:>10.2f} us per message")
+
+
+def main(groups: int) -> None:
+    # Run the benchmark
+    seed(7)
+    run_lookup(groups)
+    run_churn(groups)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -26,7 +26,9 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from pyrogram import Client, idle
 
 from plugins import glovar
-from plugins.functions.etc import delay
+from plugins.functions.etc import delay, thread
+from plugins.functions.file import compact_journals, flush_data, save
+from plugins.functions.telegram import resume_deletions
 from plugins.functions.timers import backup_files, interval_hour_01, interval_min_10, reset_data, update_admins
 from plugins.functions.timers import update_status
 
@@ -50,12 +52,18 @@ app = Client(
     sleep_threshold=0
 )
 app.start()
+glovar.loop = app.loop
+
+# Delete the messages left by the last run
+thread(resume_deletions, (app,))
 
 # Send online status
 delay(3, update_status, [app, "online"])
 
 # Timer
 scheduler = BackgroundScheduler(job_defaults={"misfire_grace_time": 60})
+scheduler.add_job(flush_data, "interval", seconds=glovar.save_interval)
+scheduler.add_job(compact_journals, "interval", hours=1)
 scheduler.add_job(interval_min_10, "interval", [app], minutes=10)
 scheduler.add_job(interval_hour_01, "interval", [app], hours=1)
 scheduler.add_job(update_status, "cron", [app, "awake"], minute=randint(30, 34), second=randint(0, 59))
@@ -68,4 +76,13 @@ scheduler.start()
 idle()
 
 # Stop
+scheduler.shutdown()
+
+glovar.timer_wheel.shutdown()
+
+for executor in list(glovar.executors.values()) + glovar.receive_executors:
+    executor.shutdown()
+
+save("usernames")
+flush_data()
 app.stop()
@@ -214,7 +214,7 @@ def send_debug(client: Client, chat: Chat, action: str, uid: int, mid: int, em:
         text += (f"{lang('user_id')}{lang('colon')}{code(uid)}\n"
                  f"{lang('action')}{lang('colon')}{code(action)}\n"
                  f"{lang('triggered_by')}{lang('colon')}{general_link(mid, message_link(em))}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), priority="debug")
 
         return True
     except Exception as e:
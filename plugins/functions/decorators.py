@@ -17,18 +17,123 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from functools import wraps
+from asyncio import sleep as sleep_async
+from functools import partial, wraps
+from inspect import isawaitable, iscoroutinefunction
+from time import sleep
 
 from pyrogram.errors import FloodWait
 
-from .etc import thread, wait_flood
+from .. import glovar
+from .etc import thread, wait_flood, wait_flood_async
+from .executor import current
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
+def async_of(sync_func):
+    # Register the coroutine function as the async mode counterpart of the sync function
+    def decorator(func):
+        glovar.coroutines[getattr(sync_func, "__wrapped__", sync_func)] = func
+        return func
+    return decorator
+
+
+def cached_filter(func):
+    # Evaluate the filter once per update, the result is cached on the update
+    @wraps(func)
+    def wrapper(flt, client, update):
+        name = func.__name__
+        results = getattr(update, "_filter_results", None)
+
+        if results is None:
+            results = {}
+            setattr(update, "_filter_results", results)
+
+        # The stats are not locked, they are only used for the status
+        stats = glovar.filter_stats.setdefault(name, {"count": 0, "evaluated": 0})
+        stats["count"] += 1
+
+        if name not in results:
+            stats["evaluated"] += 1
+            results[name] = func(flt, client, update)
+
+        return results[name]
+    return wrapper
+
+
+def is_worker_task(func) -> bool:
+    # Check if the function is the task of the current worker, then nobody waits for its result
+    task = (getattr(current, "task", None) or (None,))[0]
+
+    while task is not None:
+        if task is func:
+            return True
+
+        task = getattr(task, "__wrapped__", None)
+
+    return False
+
+
+def limited(kind: str):
+    # Wait for the rate limiter of the kind before the call, the chat is the second argument
+    # Never wait while the thread holds a global lock, the call takes the token and goes on
+    # A worker's own task does not wait in the worker, it is run again by the timer wheel when the token is due
+    def get_wait(func, args, kwargs):
+        key = args[1] if len(args) > 1 else kwargs.get("cid", kwargs.get("gid"))
+        key = key if isinstance(key, int) else None
+        wait = glovar.limiters[kind].reserve(key, not getattr(glovar.lock_holds, "count", 0))
+
+        if wait is None:
+            logger.warning(f"Rate limit {kind} rejected {func.__name__} in {key}")
+
+        return wait
+
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper_async(*args, **kwargs):
+                wait = get_wait(func, args, kwargs)
+
+                if wait is None:
+                    return None
+
+                wait and await sleep_async(wait)
+
+                return await func(*args, **kwargs)
+            return wrapper_async
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # Deferred already, the token is taken
+            if getattr(current, "reserved", False):
+                current.reserved = False
+                return func(*args, **kwargs)
+
+            wait = get_wait(func, args, kwargs)
+
+            if wait is None:
+                return None
+
+            if wait > glovar.timer_wheel.tick and is_worker_task(wrapper):
+                glovar.limiters[kind].defer()
+                glovar.timer_wheel.schedule(wait, thread, (run_reserved, current.task, None, "telegram",
+                                                           getattr(current, "priority", None)))
+                return None
+
+            wait and sleep(wait)
+
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
 def retry(func):
     # FloodWait retry
+    if iscoroutinefunction(func):
+        return retry_async(func)
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         result = None
@@ -46,11 +151,103 @@ def retry(func):
     return wrapper
 
 
-def threaded(daemon: bool = True):
-    # Run with thread
+def retry_async(func):
+    # FloodWait retry for coroutine functions
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        result = None
+        while True:
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWait as e:
+                await wait_flood_async(e)
+            except Exception as e:
+                logger.warning(f"Retry async error: {e}", exc_info=True)
+                break
+            else:
+                break
+        return result
+    return wrapper
+
+
+def run_reserved(task, args: tuple, kwargs: dict):
+    # Run a deferred task, its first rate limited call has taken the token already
+    current.reserved = True
+
+    try:
+        return task(*args, **kwargs)
+    finally:
+        current.reserved = False
+
+
+def run_steps(steps):
+    # Run the steps of a with_async function in sync mode, the requests have run when they are yielded
+    value, error = None, None
+
+    while True:
+        try:
+            step = steps.throw(error) if error else steps.send(value)
+        except StopIteration as e:
+            return e.value
+
+        value, error = None, None
+
+        try:
+            value = step() if isinstance(step, partial) else step
+        except Exception as e:
+            error = e
+
+
+async def run_steps_async(steps):
+    # Run the steps of a with_async function in async mode, the yielded requests are awaited
+    value, error = None, None
+
+    while True:
+        try:
+            step = steps.throw(error) if error else steps.send(value)
+        except StopIteration as e:
+            return e.value
+
+        value, error = None, None
+
+        try:
+            if isinstance(step, partial):
+                coroutine = glovar.coroutines.get(getattr(step.func, "__wrapped__", step.func))
+                step = coroutine(*step.args, **step.keywords) if coroutine else step()
+
+            value = await step if isawaitable(step) else step
+        except Exception as e:
+            error = e
+
+
+def threaded(executor: str = "telegram", priority: str = None):
+    # Run in the executor's worker pool
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            return thread(func, args, kwargs, daemon)
+            return thread(func, args, kwargs, executor, priority)
+        return wrapper
+    return decorator
+
+
+def with_async(*decorators):
+    # Define a function once for both modes, as a generator which yields the client's requests
+    # A call of another function is yielded as a partial, so the async mode can use its coroutine
+    # The errors of a request are raised at its yield, the decorators are applied to both versions
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return run_steps(func(*args, **kwargs))
+
+        @wraps(func)
+        async def wrapper_async(*args, **kwargs):
+            return await run_steps_async(func(*args, **kwargs))
+
+        for outer in reversed(decorators):
+            wrapper = outer(wrapper)
+            wrapper_async = outer(wrapper_async)
+
+        async_of(wrapper)(wrapper_async)
+
         return wrapper
     return decorator
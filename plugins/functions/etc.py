@@ -17,19 +17,23 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from asyncio import run_coroutine_threadsafe, sleep as sleep_async
 from datetime import datetime
 from html import escape
 from random import choice, uniform
 from string import ascii_letters, digits
-from threading import Thread, Timer
+from threading import Lock
 from time import localtime, sleep, strftime, time
 from typing import Any, Callable, Optional, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit
 
 from cryptography.fernet import Fernet
-from pyrogram.types import Message, User
+from pyrogram.types import Chat, ChatPreview, Message, User
 from pyrogram.errors import FloodWait
 
 from .. import glovar
+from .executor import TimerHandle
+from .storage import get_stats_text
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -93,18 +97,16 @@ def crypt_str(operation: str, text: str, key: bytes) -> str:
     return result
 
 
-def delay(secs: int, target: Callable, args: list) -> bool:
-    # Call a function with delay
-    try:
-        t = Timer(secs, target, args)
-        t.daemon = True
-        t.start()
+def delay(secs: int, target: Callable, args: list) -> Optional[TimerHandle]:
+    # Call a function in the worker pool with delay, the returned handle can be cancelled
+    result = None
 
-        return True
+    try:
+        result = glovar.timer_wheel.schedule(secs, thread, (target, tuple(args)))
     except Exception as e:
         logger.warning(f"Delay error: {e}", exc_info=True)
 
-    return False
+    return result
 
 
 def general_link(text: Union[int, str], link: str) -> str:
@@ -122,6 +124,53 @@ def general_link(text: Union[int, str], link: str) -> str:
     return result
 
 
+def get_cache_text() -> str:
+    # Get the cache stats text
+    result = ""
+
+    try:
+        cache_list = [("chats", glovar.chats), ("shared_url", glovar.shared_url), ("usernames", glovar.usernames)]
+        result = "\n".join(f"{name} - {cache.get_text()}" for name, cache in cache_list)
+
+        # The member caches of all groups
+        member_count = sum(len(cache) for cache in list(glovar.members.values()))
+        result += f"\nmembers - {member_count} / {len(glovar.members)} groups - {get_stats_text(glovar.member_stats)}"
+    except Exception as e:
+        logger.warning(f"Get cache text error: {e}", exc_info=True)
+
+    return result
+
+
+def get_canonical_url(url: str) -> str:
+    # Get the canonical url without the scheme, the fragment and the tracking queries
+    result = ""
+
+    try:
+        url = url.strip()
+
+        if not url:
+            return ""
+
+        parts = urlsplit(url if "://" in url else f"http://{url}")
+        host = (parts.hostname or "").lower()
+
+        if parts.port and parts.port not in {80, 443}:
+            host += f":{parts.port}"
+
+        path = parts.path.rstrip("/")
+        query = urlencode([(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                           if not (k.lower().startswith("utm_")
+                                   or k.lower() in {"fbclid", "gclid", "igshid", "mc_cid", "mc_eid",
+                                                    "ref", "ref_src", "si", "yclid"})])
+
+        result = f"{host}{path}" + (query and f"?{query}")
+    except Exception as e:
+        logger.warning(f"Get canonical url error: {e}", exc_info=True)
+        result = url
+
+    return result
+
+
 def get_channel_link(message: Union[int, Message]) -> str:
     # Get a channel reference link
     text = ""
@@ -142,6 +191,24 @@ def get_channel_link(message: Union[int, Message]) -> str:
     return text
 
 
+def get_chat_data(chat: Union[Chat, ChatPreview]) -> dict:
+    # Get the chat's metadata, the description and the pinned text are lowercased for the bypass check
+    result = {}
+
+    try:
+        result = {
+            "title": chat.title or "",
+            "username": getattr(chat, "username", None) or "",
+            "description": t2t(getattr(chat, "description", None) or "", False, False).lower(),
+            "pinned_text": get_text(getattr(chat, "pinned_message", None)).lower(),
+            "time": time()
+        }
+    except Exception as e:
+        logger.warning(f"Get chat data error: {e}", exc_info=True)
+
+    return result
+
+
 def get_command_context(message: Message) -> (str, str):
     # Get the type "a" and the context "b" in "/command a b"
     command_type = ""
@@ -180,6 +247,26 @@ def get_command_type(message: Message) -> str:
     return result
 
 
+def get_executor_text() -> str:
+    # Get the executor stats text
+    result = ""
+
+    try:
+        result = "\n".join(f"{name} - {executor.get_text()}" for name, executor in sorted(glovar.executors.items()))
+        result += "".join(f"\n{executor.name} - {executor.get_text()}" for executor in glovar.receive_executors)
+
+        if glovar.async_mode:
+            stats = glovar.async_stats
+            result += (f"\nasync - {stats['submitted'] - stats['done']} pending ({stats['pending_max']} max) - "
+                       f"{stats['submitted']} submitted")
+
+        result += f"\ntimer - {glovar.timer_wheel.get_text()}"
+    except Exception as e:
+        logger.warning(f"Get executor text error: {e}", exc_info=True)
+
+    return result
+
+
 def get_full_name(user: User) -> str:
     # Get user's full name
     text = ""
@@ -208,6 +295,18 @@ def get_int(text: str) -> Optional[int]:
     return result
 
 
+def get_limiter_text() -> str:
+    # Get the rate limiter stats text
+    result = ""
+
+    try:
+        result = "\n".join(f"{name} - {limiter.get_text()}" for name, limiter in sorted(glovar.limiters.items()))
+    except Exception as e:
+        logger.warning(f"Get limiter text error: {e}", exc_info=True)
+
+    return result
+
+
 def get_now() -> int:
     # Get time for now
     result = 0
@@ -234,6 +333,27 @@ def get_readable_time(secs: int = 0, the_format: str = "%Y%m%d%H%M%S") -> str:
     return result
 
 
+def get_route_text() -> str:
+    # Get the route stats text, with the latency histogram
+    result = ""
+
+    try:
+        bounds = [f"{bound * 1000:g}ms" for bound in glovar.route_buckets] + ["inf"]
+        result = "\n".join(f"{name} - {stats['count']} / {stats['errors']} failed - "
+                            f"{stats['latency'] / stats['count'] * 1000:.1f} ms - "
+                            + " ".join(f"{bound}:{count}" for bound, count in zip(bounds, stats["histogram"]) if count)
+                            for name, stats in sorted(list(glovar.route_stats.items())) if stats["count"])
+    except Exception as e:
+        logger.warning(f"Get route text error: {e}", exc_info=True)
+
+    return result
+
+
+def get_stripe_lock(key: int) -> Lock:
+    # Get the striped lock of a group or a user, do not send any request while holding it
+    return glovar.stripe_locks[hash(key) % len(glovar.stripe_locks)]
+
+
 def get_stripped_link(link: str) -> str:
     # Get stripped link
     result = ""
@@ -282,6 +402,22 @@ def lang(text: str) -> str:
     return result
 
 
+def lock_acquire(name: str) -> bool:
+    # Acquire a global lock, the rate limiters do not sleep in the thread until it is released
+    glovar.locks[name].acquire()
+    glovar.lock_holds.count = getattr(glovar.lock_holds, "count", 0) + 1
+
+    return True
+
+
+def lock_release(name: str) -> bool:
+    # Release a global lock acquired by lock_acquire
+    glovar.lock_holds.count = getattr(glovar.lock_holds, "count", 1) - 1
+    glovar.locks[name].release()
+
+    return True
+
+
 def mention_id(uid: int) -> str:
     # Get a ID mention string
     result = ""
@@ -333,20 +469,45 @@ def t2t(text: str, normal: bool, printable: bool) -> str:
     return text
 
 
-def thread(target: Callable, args: tuple, kwargs: dict = None, daemon: bool = True) -> bool:
-    # Call a function using thread
+def thread(target: Callable, args: tuple, kwargs: dict = None, executor: str = "telegram",
+           priority: str = None) -> bool:
+    # Call a function in the executor's worker pool, or schedule its coroutine on the event loop in async mode
     result = False
 
     try:
-        t = Thread(target=target, args=args, kwargs=kwargs, daemon=daemon)
-        t.daemon = daemon
-        result = t.start() or True
+        coroutine = (glovar.async_mode and glovar.loop and executor == "telegram"
+                     and glovar.coroutines.get(getattr(target, "__wrapped__", target)))
+
+        if coroutine:
+            return thread_async(coroutine, args, kwargs)
+
+        result = glovar.executors[executor].submit(target, args, kwargs, priority) is not None
     except Exception as e:
         logger.warning(f"Thread error: {e}", exc_info=True)
 
     return result
 
 
+def thread_async(coroutine: Callable, args: tuple, kwargs: dict = None) -> bool:
+    # Schedule a coroutine function on the event loop
+    result = False
+
+    try:
+        future = run_coroutine_threadsafe(coroutine(*args, **(kwargs or {})), glovar.loop)
+
+        future.add_done_callback(lambda _: glovar.async_stats.update(done=glovar.async_stats["done"] + 1))
+
+        stats = glovar.async_stats
+        stats["submitted"] += 1
+        stats["pending_max"] = max(stats["pending_max"], stats["submitted"] - stats["done"])
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Thread async error: {e}", exc_info=True)
+
+    return result
+
+
 def wait_flood(e: FloodWait) -> bool:
     # Wait flood secs
     result = False
@@ -357,3 +518,15 @@ def wait_flood(e: FloodWait) -> bool:
         logger.warning(f"Wait flood error: {e}", exc_info=True)
 
     return result
+
+
+async def wait_flood_async(e: FloodWait) -> bool:
+    # Wait flood secs without holding a thread
+    result = False
+
+    try:
+        result = await sleep_async(e.value + uniform(0.5, 1.0)) or True
+    except Exception as e:
+        logger.warning(f"Wait flood async error: {e}", exc_info=True)
+
+    return result
@@ -0,0 +1,308 @@
+# SCP-079-USER - Invite and help other bots
+# Copyright (C) 2019-2023 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-USER.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# This module is imported by glovar, so it must not import glovar
+
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from math import ceil
+from threading import BoundedSemaphore, Event, Lock, Thread, current_thread, local
+from time import monotonic, time
+from typing import Callable, Deque, List, Optional, Tuple
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# The priority of the task running in the current worker, the tasks it submits inherit it
+# The task itself is kept as well, as (task, args, kwargs)
+current = local()
+
+
+class BoundedExecutor:
+    # A named thread pool with a bounded priority queue, it blocks or rejects new tasks when saturated
+    # The highest priority task runs first, unless a queued task has waited longer than starve seconds
+
+    def __init__(self, name: str, workers: int, queue_size: int, policy: str = "block",
+                 priorities: Tuple[str, ...] = ("normal",), default: str = "normal", starve: float = 10.0):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.policy = policy
+        self.priorities = priorities
+        self.default = default
+        self.starve = starve
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-")
+        self.queues: List[Deque[tuple]] = [deque() for _ in priorities]
+        self.slots = BoundedSemaphore(workers + queue_size)
+        self.lock = Lock()
+        self.stats = {
+            "submitted": 0,
+            "rejected": 0,
+            "inline": 0,
+            "queued": 0,
+            "queued_max": 0,
+            "running": 0,
+            "starved": 0,
+            "wait": 0.0,
+            "wait_max": 0.0
+        }
+        self.priority_stats = {priority: {"count": 0, "wait": 0.0, "wait_max": 0.0} for priority in priorities}
+
+    def __repr__(self) -> str:
+        return f"<BoundedExecutor {self.name} {self.workers} + {self.queue_size}>"
+
+    def get_text(self) -> str:
+        # Get the stats text
+        with self.lock:
+            stats = dict(self.stats)
+            priority_stats = {priority: dict(stats) for priority, stats in self.priority_stats.items()}
+
+        started = stats["submitted"] - stats["queued"]
+        wait = stats["wait"] / started * 1000 if started else 0.0
+        result = (f"{stats['running']} / {self.workers} running - {stats['queued']} / {self.queue_size} queued "
+                  f"({stats['queued_max']} max) - {stats['submitted']} submitted / {stats['rejected']} rejected / "
+                  f"{stats['inline']} inline - "
+                  f"{wait:.1f} ms / {stats['wait_max'] * 1000:.1f} ms wait")
+
+        if len(self.priorities) < 2:
+            return result
+
+        result += f" - {stats['starved']} starved"
+
+        for priority in self.priorities:
+            stats = priority_stats[priority]
+            wait = stats["wait"] / stats["count"] * 1000 if stats["count"] else 0.0
+            result += f"\n    {priority} - {stats['count']} - {wait:.1f} ms / {stats['wait_max'] * 1000:.1f} ms wait"
+
+        return result
+
+    def run(self) -> None:
+        # Run the next queued task in a worker, record the wait time
+        with self.lock:
+            now = time()
+            heads = [(queue[0][0], level) for level, queue in enumerate(self.queues) if queue]
+            start, level = min(heads)
+
+            # Take the longest waiting task if it starves, otherwise the highest priority one
+            if now - start > self.starve and level != heads[0][1]:
+                self.stats["starved"] += 1
+            else:
+                level = heads[0][1]
+
+            start, future, task, args, kwargs = self.queues[level].popleft()
+            priority = self.priorities[level]
+            wait = now - start
+
+            self.stats["queued"] -= 1
+            self.stats["running"] += 1
+            self.stats["wait"] += wait
+            self.stats["wait_max"] = max(self.stats["wait_max"], wait)
+            self.priority_stats[priority]["count"] += 1
+            self.priority_stats[priority]["wait"] += wait
+            self.priority_stats[priority]["wait_max"] = max(self.priority_stats[priority]["wait_max"], wait)
+
+        current.priority = priority
+        current.task = (task, args, kwargs)
+
+        try:
+            if future.set_running_or_notify_cancel():
+                future.set_result(task(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            current.priority = None
+            current.task = None
+
+            with self.lock:
+                self.stats["running"] -= 1
+
+            self.slots.release()
+
+    def shutdown(self) -> None:
+        # Stop accepting tasks, the queued tasks are still run
+        self.executor.shutdown(wait=False)
+
+    def submit(self, task: Callable, args: tuple = (), kwargs: dict = None,
+               priority: str = None) -> Optional[Future]:
+        # Submit a task, return None if it is rejected
+        # Without a priority, the task inherits the priority of the current worker
+        kwargs = kwargs or {}
+        priority = priority or getattr(current, "priority", None) or self.default
+        priority = priority if priority in self.priorities else self.default
+
+        # A worker of this pool never blocks on its own pool, so the pool can not deadlock itself
+        in_pool = current_thread().name.startswith(f"{self.name}-")
+
+        acquired = self.slots.acquire(blocking=self.policy == "block" and not in_pool)
+
+        # Saturated, the worker runs the task in place
+        if not acquired and in_pool:
+            with self.lock:
+                self.stats["inline"] += 1
+
+            future = Future()
+
+            try:
+                future.set_result(task(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+            return future
+
+        if not acquired:
+            with self.lock:
+                self.stats["rejected"] += 1
+
+            logger.warning(f"Executor {self.name} is saturated, reject {getattr(task, '__name__', task)}")
+
+            return None
+
+        future = Future()
+        queue = self.queues[self.priorities.index(priority)]
+        item = (time(), future, task, args, kwargs)
+
+        with self.lock:
+            queue.append(item)
+            self.stats["submitted"] += 1
+            self.stats["queued"] += 1
+            self.stats["queued_max"] = max(self.stats["queued_max"], self.stats["queued"])
+
+        try:
+            self.executor.submit(self.run)
+        except Exception:
+            with self.lock:
+                queue.remove(item)
+                self.stats["submitted"] -= 1
+                self.stats["queued"] -= 1
+
+            self.slots.release()
+            raise
+
+        return future
+
+
+class TimerHandle:
+    # A scheduled callback of the timer wheel
+
+    __slots__ = ("due", "tick", "callback", "args", "cancelled")
+
+    def __init__(self, due: float, tick: int, callback: Callable, args: tuple):
+        self.due = due
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __repr__(self) -> str:
+        return f"<TimerHandle {getattr(self.callback, '__name__', self.callback)} in {self.due - monotonic():.1f}s>"
+
+
+class TimerWheel:
+    # A hashed timer wheel, one thread runs the due callbacks of all the delayed calls
+    # The callbacks must be quick, they should hand the work over to a worker pool
+
+    def __init__(self, name: str, tick: float = 0.5, slots: int = 1024):
+        self.name = name
+        self.tick = tick
+        self.slots: List[List[TimerHandle]] = [[] for _ in range(slots)]
+        self.start = monotonic()
+        self.current = 0
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread: Optional[Thread] = None
+        self.stats = {
+            "scheduled": 0,
+            "fired": 0,
+            "cancelled": 0,
+            "pending": 0,
+            "pending_max": 0,
+            "late_max": 0.0
+        }
+
+    def __repr__(self) -> str:
+        return f"<TimerWheel {self.name} {self.tick}s x {len(self.slots)}>"
+
+    def cancel(self, handle: TimerHandle) -> bool:
+        # Cancel a pending callback, it is dropped when its slot is visited
+        with self.lock:
+            if handle.cancelled or handle.tick <= self.current:
+                return False
+
+            handle.cancelled = True
+            self.stats["cancelled"] += 1
+            self.stats["pending"] -= 1
+
+        return True
+
+    def get_pending(self) -> List[TimerHandle]:
+        # Get the pending callbacks, sorted by the due time
+        with self.lock:
+            result = [handle for slot in self.slots for handle in slot if not handle.cancelled]
+
+        return sorted(result, key=lambda handle: handle.due)
+
+    def get_text(self) -> str:
+        # Get the stats text
+        with self.lock:
+            stats = dict(self.stats)
+
+        return (f"{stats['pending']} pending ({stats['pending_max']} max) - {stats['scheduled']} scheduled / "
+                f"{stats['fired']} fired / {stats['cancelled']} cancelled - {stats['late_max'] * 1000:.0f} ms late max")
+
+    def run(self) -> None:
+        # Visit the slots tick by tick, run the due callbacks
+        while not self.stopped.wait(max(0.0, self.start + (self.current + 1) * self.tick - monotonic())):
+            with self.lock:
+                self.current += 1
+                slot = self.slots[self.current % len(self.slots)]
+                due = [handle for handle in slot if handle.tick <= self.current]
+                slot[:] = [handle for handle in slot if handle.tick > self.current]
+                due = [handle for handle in due if not handle.cancelled]
+                self.stats["fired"] += len(due)
+                self.stats["pending"] -= len(due)
+
+            now = monotonic()
+
+            for handle in due:
+                try:
+                    self.stats["late_max"] = max(self.stats["late_max"], now - handle.due)
+                    handle.callback(*handle.args)
+                except Exception as e:
+                    logger.warning(f"Timer {self.name} callback {handle} error: {e}", exc_info=True)
+
+    def schedule(self, secs: float, callback: Callable, args: tuple = ()) -> TimerHandle:
+        # Call the callback after secs, O(1)
+        with self.lock:
+            due = monotonic() + secs
+            tick = max(self.current + 1, ceil((due - self.start) / self.tick))
+            handle = TimerHandle(due, tick, callback, args)
+            self.slots[tick % len(self.slots)].append(handle)
+            self.stats["scheduled"] += 1
+            self.stats["pending"] += 1
+            self.stats["pending_max"] = max(self.stats["pending_max"], self.stats["pending"])
+
+            if self.thread is None:
+                self.thread = Thread(target=self.run, name=self.name, daemon=True)
+                self.thread.start()
+
+        return handle
+
+    def shutdown(self) -> None:
+        # Stop the thread, the pending callbacks are dropped
+        self.stopped.set()
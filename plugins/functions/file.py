@@ -17,17 +17,17 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from os import remove
-from os.path import exists
-from pickle import dump
+from os import O_RDONLY, close, fsync, link, open as os_open, remove, replace
+from os.path import exists, getsize
+from pickle import dump, dumps
 from shutil import copyfile
+from time import time
 from typing import Any
 
 from pyAesCrypt import decryptFile, encryptFile
 from pyrogram import Client
 
 from .. import glovar
-from .decorators import threaded
 from .etc import random_str
 from .telegram import download_media
 
@@ -35,12 +35,40 @@ from .telegram import download_media
 logger = logging.getLogger(__name__)
 
 
+def compact_journals() -> bool:
+    # Save the journaled global variables as new snapshots
+    result = False
+
+    try:
+        for file in glovar.journal_list:
+            if exists(f"data/{file}.journal") and getsize(f"data/{file}.journal"):
+                save(file)
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Compact journals error: {e}", exc_info=True)
+
+    return result
+
+
 def crypt_file(operation: str, file_in: str, file_out: str) -> bool:
-    # Encrypt or decrypt a file
+    # Encrypt or decrypt a file in the crypto pool, wait for the result
     try:
         if not file_in or not file_out:
             return True
 
+        future = glovar.executors["crypto"].submit(crypt_file_run, (operation, file_in, file_out))
+
+        return bool(future and future.result())
+    except Exception as e:
+        logger.warning(f"Crypt file error: {e}", exc_info=True)
+
+    return False
+
+
+def crypt_file_run(operation: str, file_in: str, file_out: str) -> bool:
+    # Encrypt or decrypt a file
+    try:
         buffer_ = 64 * 1024
 
         if operation == "decrypt":
@@ -83,6 +111,31 @@ def delete_file(path: str) -> bool:
     return False
 
 
+def flush_data() -> bool:
+    # Save all changed global variables to files
+    result = False
+
+    glovar.locks["flush"].acquire()
+
+    try:
+        with glovar.locks["save"]:
+            file_list = list(glovar.dirty_files)
+            glovar.dirty_files.clear()
+
+        failed_list = [file for file in file_list if not save_file(file)]
+
+        with glovar.locks["save"]:
+            glovar.dirty_files.update(failed_list)
+
+        result = not failed_list
+    except Exception as e:
+        logger.warning(f"Flush data error: {e}", exc_info=True)
+    finally:
+        glovar.locks["flush"].release()
+
+    return result
+
+
 def get_downloaded_path(client: Client, file_id: str) -> str:
     # Download file, get it's path on local machine
     final_path = ""
@@ -114,20 +167,137 @@ def get_new_path(extension: str = "", prefix: str = "") -> str:
     return result
 
 
-@threaded(daemon=False)
+def get_save_text() -> str:
+    # Get the save stats text
+    result = ""
+
+    try:
+        result = "\n".join(f"{file} - {stats['count']} / {stats['bytes']} B / "
+                           f"{stats['latency'] * 1000:.1f} ms / {stats['latency_max'] * 1000:.1f} ms"
+                           for file, stats in sorted(glovar.save_stats.items()))
+    except Exception as e:
+        logger.warning(f"Get save text error: {e}", exc_info=True)
+
+    return result
+
+
 def save(file: str) -> bool:
+    # Mark a global variable as changed, it will be saved by flush_data()
+    result = False
+
+    try:
+        # The database is written incrementally
+        if glovar.database and file in glovar.storage_list:
+            return True
+
+        with glovar.locks["save"]:
+            glovar.dirty_files.add(file)
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Save error: {e}", exc_info=True)
+
+    return result
+
+
+def save_file(file: str) -> bool:
     # Save a global variable to a file
     result = False
 
+    journal = file in glovar.journal_list
+    journal and glovar.locks["journal"].acquire()
+
     try:
         if not glovar:
             return False
 
-        with open(f"data/.{file}", "wb") as f:
-            dump(eval(f"glovar.{file}"), f)
+        start = time()
+        data = dumps(eval(f"glovar.{file}"))
 
-        result = copyfile(f"data/.{file}", f"data/{file}") or True
+        # Write the new generation
+        with open(f"data/{file}.tmp", "wb") as f:
+            f.write(data)
+            f.flush()
+            fsync(f.fileno())
+
+        # Keep the current generation as the previous one, a hard link copies nothing
+        if exists(f"data/{file}"):
+            exists(f"data/.{file}.tmp") and remove(f"data/.{file}.tmp")
+
+            # Some file systems do not support hard links
+            try:
+                link(f"data/{file}", f"data/.{file}.tmp")
+            except OSError:
+                copyfile(f"data/{file}", f"data/.{file}.tmp")
+
+            replace(f"data/.{file}.tmp", f"data/.{file}")
+
+        # Commit
+        replace(f"data/{file}.tmp", f"data/{file}")
+        sync_dir("data")
+
+        # The snapshot contains all the records now
+        journal and open(f"data/{file}.journal", "wb").close()
+
+        latency = time() - start
+        stats = glovar.save_stats.setdefault(file, {"count": 0, "bytes": 0, "latency": 0.0, "latency_max": 0.0})
+        stats["count"] += 1
+        stats["bytes"] += len(data)
+        stats["latency"] = latency
+        stats["latency_max"] = max(stats["latency_max"], latency)
+
+        result = True
     except Exception as e:
-        logger.warning(f"Save error: {e}", exc_info=True)
+        logger.warning(f"Save file {file} error: {e}", exc_info=True)
+    finally:
+        journal and glovar.locks["journal"].release()
+
+    return result
+
+
+def sync_dir(path: str) -> bool:
+    # Make the renames in a directory durable
+    result = False
+
+    try:
+        fd = os_open(path, O_RDONLY)
+
+        try:
+            fsync(fd)
+        finally:
+            close(fd)
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Sync dir error: {e}", exc_info=True)
+
+    return result
+
+
+def write_journal(file: str, the_type: str, uid: int = 0, gid: int = 0,
+                  project: str = "", score: float = 0.0) -> bool:
+    # Append a record to the file's journal, should be called with the journal lock
+    result = False
+
+    try:
+        # The database is written incrementally
+        if glovar.database and file in glovar.storage_list:
+            return True
+
+        record = glovar.journal_struct.pack(
+            glovar.journal_types.index(the_type),
+            glovar.journal_projects.index(project) if project else 0,
+            uid,
+            gid,
+            score
+        )
+
+        with open(f"data/{file}.journal", "ab") as f:
+            f.write(record)
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Write journal error: {e}", exc_info=True)
+        save(file)
 
     return result
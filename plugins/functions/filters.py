@@ -21,9 +21,11 @@ import re
 from typing import Union
 
 from pyrogram import Client, filters
+from pyrogram.enums import ChatMemberStatus
 from pyrogram.types import CallbackQuery, Message, User
 
 from .. import glovar
+from .decorators import cached_filter
 from .group import get_member
 from .ids import init_group_id
 from .telegram import resolve_username
@@ -177,6 +179,18 @@ def is_exchange_channel(_, __, message: Message) -> bool:
     return False
 
 
+def is_first_message(_, __, ___) -> bool:
+    # Check if no message has been handled since startup
+    result = False
+
+    try:
+        result = not glovar.first_message_time
+    except Exception as e:
+        logger.warning(f"Is first message error: {e}", exc_info=True)
+
+    return result
+
+
 def is_from_user(_, __, message: Message) -> bool:
     # Check if the message is sent from a user
     try:
@@ -246,32 +260,32 @@ aio = filters.create(
 )
 
 authorized_group = filters.create(
-    func=is_authorized_group,
+    func=cached_filter(is_authorized_group),
     name="Authorized Group"
 )
 
 captcha_group = filters.create(
-    func=is_captcha_group,
+    func=cached_filter(is_captcha_group),
     name="CAPTCHA Group"
 )
 
 class_c = filters.create(
-    func=is_class_c,
+    func=cached_filter(is_class_c),
     name="Class C"
 )
 
 class_d = filters.create(
-    func=is_class_d,
+    func=cached_filter(is_class_d),
     name="Class D"
 )
 
 class_e = filters.create(
-    func=is_class_e,
+    func=cached_filter(is_class_e),
     name="Class E"
 )
 
 declared_message = filters.create(
-    func=is_declared_message,
+    func=cached_filter(is_declared_message),
     name="Declared message"
 )
 
@@ -280,8 +294,13 @@ exchange_channel = filters.create(
     name="Exchange Channel"
 )
 
+first_message = filters.create(
+    func=is_first_message,
+    name="First Message"
+)
+
 from_user = filters.create(
-    func=is_from_user,
+    func=cached_filter(is_from_user),
     name="From User"
 )
 
@@ -291,16 +310,32 @@ hide_channel = filters.create(
 )
 
 new_group = filters.create(
-    func=is_new_group,
+    func=cached_filter(is_new_group),
     name="New Group"
 )
 
 test_group = filters.create(
-    func=is_test_group,
+    func=cached_filter(is_test_group),
     name="Test Group"
 )
 
 
+def get_filter_text() -> str:
+    # Get the filter stats text, evaluated / called
+    result = ""
+
+    try:
+        stats_list = sorted(glovar.filter_stats.items())
+        count = sum(stats["count"] for _, stats in stats_list)
+        evaluated = sum(stats["evaluated"] for _, stats in stats_list)
+        result = "\n".join(f"{name} - {stats['evaluated']} / {stats['count']}" for name, stats in stats_list)
+        result += f"\ntotal - {evaluated} / {count}"
+    except Exception as e:
+        logger.warning(f"Get filter text error: {e}", exc_info=True)
+
+    return result
+
+
 def is_class_d_user(user: Union[int, User]) -> bool:
     # Check if the user is a Class D personnel
     try:
@@ -328,11 +363,8 @@ def is_class_e_user(user: Union[int, User]) -> bool:
         if uid in glovar.bot_ids:
             return True
 
-        group_list = list(glovar.trust_ids)
-
-        for gid in group_list:
-            if uid in glovar.trust_ids.get(gid, set()):
-                return True
+        if glovar.trust_users.get(uid):
+            return True
     except Exception as e:
         logger.warning(f"Is class e user error: {e}", exc_info=True)
 
@@ -381,7 +413,8 @@ def is_friend_username(client: Client, gid: int, username: str, friend: bool, fr
 
             member = get_member(client, gid, peer_id)
 
-            if member and member.status in {"creator", "administrator", "member"}:
+            if member and member["status"] in {ChatMemberStatus.OWNER, ChatMemberStatus.ADMINISTRATOR,
+                                               ChatMemberStatus.MEMBER}:
                 return True
     except Exception as e:
         logger.warning(f"Is friend username: {e}", exc_info=True)
@@ -395,15 +428,9 @@ def is_high_score_user(user: User) -> float:
         if is_class_e_user(user):
             return 0.0
 
-        uid = user.id
-        user_status = glovar.user_ids.get(uid, {})
-
-        if not user_status:
-            return 0.0
-
-        score = sum(user_status["score"].values())
+        score = glovar.user_scores.get(user.id, 0.0)
 
-        if score >= 3.0:
+        if score >= glovar.high_score:
             return score
     except Exception as e:
         logger.warning(f"Is high score user error: {e}", exc_info=True)
@@ -17,24 +17,25 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from time import time
 from typing import Iterable, List, Optional
 
 from pyrogram import Client
 from pyrogram.enums import ChatMemberStatus
-from pyrogram.types import Chat, ChatMember, Message
+from pyrogram.types import ChatMember
 
 from .. import glovar
 from .decorators import threaded
-from .etc import code, lang, t2t, thread
+from .etc import code, get_chat_data, lang, thread
 from .file import save
-from .ids import init_group_id
+from .ids import init_group_id, remove_trust_group, set_trust_group
 from .telegram import delete_messages, delete_all_messages, get_chat, get_chat_member, get_common_chats, leave_chat
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
-@threaded()
+@threaded(priority="action")
 def delete_message(client: Client, gid: int, mid: int) -> bool:
     # Delete a single message
     result = False
@@ -51,7 +52,7 @@ def delete_message(client: Client, gid: int, mid: int) -> bool:
     return result
 
 
-@threaded()
+@threaded(priority="action")
 def delete_messages_globally(client: Client, uid: int, no_id: int = 0) -> bool:
     # Delete all messages from a user globally
     result = False
@@ -85,7 +86,7 @@ def delete_messages_globally(client: Client, uid: int, no_id: int = 0) -> bool:
     return result
 
 
-@threaded()
+@threaded(priority="action")
 def delete_messages_from_users(client: Client, gid: int, uids: Iterable[int]) -> bool:
     # Delete messages from users
     result = False
@@ -126,43 +127,41 @@ def get_config_text(config: dict) -> str:
 
 
 def get_description(client: Client, gid: int, cache: bool = True) -> str:
-    # Get group's description
+    # Get group's lowercased description
     result = ""
     try:
         group = get_group(client, gid, cache)
 
-        if group and group.description:
-            result = t2t(group.description, False, False)
+        if group:
+            result = group["description"]
     except Exception as e:
         logger.warning(f"Get description error: {e}", exc_info=True)
 
     return result
 
 
-def get_group(client: Client, gid: int, cache: bool = True) -> Optional[Chat]:
-    # Get the group
+def get_group(client: Client, gid: int, cache: bool = True) -> Optional[dict]:
+    # Get the group's metadata, an old cache is returned and refreshed in background
     result = None
 
     try:
         the_cache = glovar.chats.get(gid)
 
         if cache and the_cache:
-            return the_cache
-
-        result = get_chat(client, gid)
+            if time() - the_cache["time"] > glovar.chat_cache_ttl:
+                refresh_group(client, gid)
 
-        if not result:
-            return result
+            return the_cache
 
-        glovar.chats[gid] = result
+        result = update_group(client, gid)
     except Exception as e:
         logger.warning(f"Get group error: {e}", exc_info=True)
 
     return result
 
 
-def get_member(client: Client, gid: int, uid: int, cache: bool = True) -> Optional[ChatMember]:
-    # Get a member in the group
+def get_member(client: Client, gid: int, uid: int, cache: bool = True) -> Optional[dict]:
+    # Get a member's status and privileges in the group, an empty dict means the user is not a member
     result = None
 
     try:
@@ -171,34 +170,41 @@ def get_member(client: Client, gid: int, uid: int, cache: bool = True) -> Option
 
         the_cache = glovar.members[gid].get(uid)
 
-        if cache and the_cache:
+        if cache and the_cache is not None:
             return the_cache
 
-        result = get_chat_member(client, gid, uid)
+        member = get_chat_member(client, gid, uid)
 
-        if not result:
-            return result
+        if member is None:
+            return None
 
-        glovar.members[gid][uid] = result
+        if member:
+            result = {
+                "status": member.status,
+                "can_delete_messages": bool(member.privileges and member.privileges.can_delete_messages),
+                "can_restrict_members": bool(member.privileges and member.privileges.can_restrict_members)
+            }
+        else:
+            result = {}
+
+        glovar.members[gid].set(uid, result)
     except Exception as e:
         logger.warning(f"Get member error: {e}", exc_info=True)
 
     return result
 
 
-def get_pinned(client: Client, gid: int, cache: bool = True) -> Optional[Message]:
-    # Get group's pinned message
-    result = None
+def get_pinned_text(client: Client, gid: int, cache: bool = True) -> str:
+    # Get group's lowercased pinned text
+    result = ""
 
     try:
         group = get_group(client, gid, cache)
 
-        if not group or not group.pinned_message:
-            return None
-
-        result = group.pinned_message
+        if group:
+            result = group["pinned_text"]
     except Exception as e:
-        logger.warning(f"Get pinned error: {e}", exc_info=True)
+        logger.warning(f"Get pinned text error: {e}", exc_info=True)
 
     return result
 
@@ -218,8 +224,7 @@ def leave_group(client: Client, gid: int) -> bool:
         glovar.admin_ids.pop(gid, set())
         save("admin_ids")
 
-        glovar.trust_ids.pop(gid, set())
-        save("trust_ids")
+        remove_trust_group(gid)
 
         glovar.configs.pop(gid, {})
         save("configs")
@@ -235,6 +240,26 @@ def leave_group(client: Client, gid: int) -> bool:
     return result
 
 
+def refresh_group(client: Client, gid: int) -> bool:
+    # Refresh the group's metadata in background, only one refresh for a group at a time
+    result = False
+
+    glovar.locks["chat"].acquire()
+
+    try:
+        if gid in glovar.chats_refreshing:
+            return False
+
+        glovar.chats_refreshing.add(gid)
+        result = thread(update_group, (client, gid))
+    except Exception as e:
+        logger.warning(f"Refresh group error: {e}", exc_info=True)
+    finally:
+        glovar.locks["chat"].release()
+
+    return result
+
+
 def save_admins(gid: int, admin_members: List[ChatMember]) -> bool:
     # Save the group's admin list
     result = False
@@ -250,13 +275,35 @@ def save_admins(gid: int, admin_members: List[ChatMember]) -> bool:
         save("admin_ids")
 
         # Trust list
-        glovar.trust_ids[gid] = {admin.user.id for admin in admin_members
-                                 if ((not admin.user.is_bot and not admin.user.is_deleted)
-                                     or admin.user.id in glovar.bot_ids)}
-        save("trust_ids")
+        set_trust_group(gid, {admin.user.id for admin in admin_members
+                              if ((not admin.user.is_bot and not admin.user.is_deleted)
+                                  or admin.user.id in glovar.bot_ids)})
+
+        # The cached members may be promoted or demoted
+        glovar.members.get(gid) and glovar.members[gid].clear()
 
         result = True
     except Exception as e:
         logger.warning(f"Save admins error: {e}", exc_info=True)
 
     return result
+
+
+def update_group(client: Client, gid: int) -> Optional[dict]:
+    # Update the group's metadata
+    result = None
+
+    try:
+        chat = get_chat(client, gid)
+
+        if not chat:
+            return None
+
+        result = get_chat_data(chat)
+        result and glovar.chats.set(gid, result)
+    except Exception as e:
+        logger.warning(f"Update group error: {e}", exc_info=True)
+    finally:
+        glovar.chats_refreshing.discard(gid)
+
+    return result
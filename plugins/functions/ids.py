@@ -18,14 +18,53 @@
 
 import logging
 from copy import deepcopy
+from heapq import heappop, heappush
+from typing import Iterable, Set
 
 from .. import glovar
-from .file import save
+from .file import save, write_journal
+from .storage import ExpiringCache, MessageIdWindow, resolve_data
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
+def add_user_group(uid: int, gid: int, the_type: str) -> bool:
+    # Add a group to the user's ban or restrict list
+    result = False
+
+    glovar.locks["journal"].acquire()
+
+    try:
+        glovar.user_ids[uid][the_type].add(gid)
+        result = write_journal("user_ids", the_type, uid, gid)
+    except Exception as e:
+        logger.warning(f"Add user group error: {e}", exc_info=True)
+    finally:
+        glovar.locks["journal"].release()
+
+    return result
+
+
+def clear_users() -> bool:
+    # Clear all users' data
+    result = False
+
+    glovar.locks["journal"].acquire()
+
+    try:
+        glovar.user_ids.clear()
+        glovar.user_scores.clear()
+        glovar.high_score_users.clear()
+        result = write_journal("user_ids", "clear")
+    except Exception as e:
+        logger.warning(f"Clear users error: {e}", exc_info=True)
+    finally:
+        glovar.locks["journal"].release()
+
+    return result
+
+
 def init_group_id(gid: int) -> bool:
     # Init group data
     try:
@@ -47,10 +86,11 @@ def init_group_id(gid: int) -> bool:
             save("configs")
 
         if glovar.declared_message_ids.get(gid) is None:
-            glovar.declared_message_ids[gid] = set()
+            glovar.declared_message_ids[gid] = MessageIdWindow(glovar.message_id_window)
 
         if glovar.members.get(gid) is None:
-            glovar.members[gid] = {}
+            glovar.members[gid] = ExpiringCache(glovar.member_cache_size, glovar.member_cache_ttl,
+                                                glovar.member_stats)
 
         if glovar.recorded_ids.get(gid) is None:
             glovar.recorded_ids[gid] = set()
@@ -70,11 +110,292 @@ def init_user_id(uid: int) -> bool:
             save("except_ids")
 
         if glovar.user_ids.get(uid) is None:
-            glovar.user_ids[uid] = deepcopy(glovar.default_user_status)
-            save("user_ids")
+            reset_user(uid)
 
         return True
     except Exception as e:
         logger.warning(f"Init user id {uid} error: {e}", exc_info=True)
 
     return False
+
+
+def prune_watch_heap(now: int) -> bool:
+    # Pop the expired entries from the watch heap, should be called with the watch lock
+    changed = False
+
+    # The database finds the expired entries with its index, there is no heap
+    if glovar.database:
+        for the_type in ["ban", "delete"]:
+            for uid in glovar.watch_ids[the_type].get_expired(now):
+                glovar.watch_ids[the_type].pop(uid, 0)
+                changed = True
+
+        changed and save("watch_ids")
+
+        return changed
+
+    # The heap functions need the list itself, not the lazy proxy
+    watch_heap = resolve_data(glovar.watch_heap)
+
+    while watch_heap and watch_heap[0][0] <= now:
+        until, the_type, uid = heappop(watch_heap)
+
+        # The entry may be replaced or removed already
+        if glovar.watch_ids[the_type].get(uid) != until:
+            continue
+
+        glovar.watch_ids[the_type].pop(uid, 0)
+        changed = True
+
+    # Rebuild the heap when it is mostly replaced entries
+    if len(watch_heap) > 1024 + 2 * sum(len(glovar.watch_ids[t]) for t in ["ban", "delete"]):
+        glovar.watch_heap = glovar.index_watch_ids(glovar.watch_ids)
+
+    changed and save("watch_ids")
+
+    return changed
+
+
+def prune_watch_users(now: int) -> bool:
+    # Remove the expired watch users
+    result = False
+
+    glovar.locks["watch"].acquire()
+
+    try:
+        result = prune_watch_heap(now)
+    except Exception as e:
+        logger.warning(f"Prune watch users error: {e}", exc_info=True)
+    finally:
+        glovar.locks["watch"].release()
+
+    return result
+
+
+def remove_trust_group(gid: int) -> bool:
+    # Remove the group's trust list
+    result = False
+
+    # The index is built in background at startup, trust_ids must not change before it is done
+    resolve_data(glovar.trust_users)
+
+    glovar.locks["trust"].acquire()
+
+    try:
+        uid_set = set(glovar.trust_ids.pop(gid, set()))
+        update_trust_users(uid_set, set())
+        result = save("trust_ids")
+    except Exception as e:
+        logger.warning(f"Remove trust group error: {e}", exc_info=True)
+    finally:
+        glovar.locks["trust"].release()
+
+    return result
+
+
+def remove_user_group(uid: int, gid: int, the_type: str) -> bool:
+    # Remove a group from the user's ban or restrict list
+    result = False
+
+    glovar.locks["journal"].acquire()
+
+    try:
+        glovar.user_ids[uid][the_type].discard(gid)
+        result = write_journal("user_ids", f"un{the_type}", uid, gid)
+    except Exception as e:
+        logger.warning(f"Remove user group error: {e}", exc_info=True)
+    finally:
+        glovar.locks["journal"].release()
+
+    return result
+
+
+def remove_watch_user(uid: int) -> bool:
+    # Remove the user from watch_ids, the entries in the heap are skipped later
+    result = False
+
+    glovar.locks["watch"].acquire()
+
+    try:
+        for the_type in ["ban", "delete"]:
+            if glovar.watch_ids[the_type].pop(uid, None) is not None:
+                result = True
+
+        result and save("watch_ids")
+    except Exception as e:
+        logger.warning(f"Remove watch user error: {e}", exc_info=True)
+    finally:
+        glovar.locks["watch"].release()
+
+    return result
+
+
+def reset_trust_users() -> bool:
+    # Rebuild the reverse index of trust_ids
+    result = False
+
+    # The index is built in background at startup, trust_ids must not change before it is done
+    resolve_data(glovar.trust_users)
+
+    glovar.locks["trust"].acquire()
+
+    try:
+        glovar.trust_users = glovar.index_trust_ids(glovar.trust_ids)
+        result = True
+    except Exception as e:
+        logger.warning(f"Reset trust users error: {e}", exc_info=True)
+    finally:
+        glovar.locks["trust"].release()
+
+    return result
+
+
+def reset_user(uid: int) -> bool:
+    # Reset the user's data to default
+    result = False
+
+    glovar.locks["journal"].acquire()
+
+    try:
+        glovar.user_ids[uid] = deepcopy(glovar.default_user_status)
+        update_user_score(uid, 0.0)
+        result = write_journal("user_ids", "reset", uid)
+    except Exception as e:
+        logger.warning(f"Reset user error: {e}", exc_info=True)
+    finally:
+        glovar.locks["journal"].release()
+
+    return result
+
+
+def reset_user_scores() -> bool:
+    # Rebuild the users' total scores
+    result = False
+
+    glovar.locks["journal"].acquire()
+
+    try:
+        glovar.user_scores = glovar.index_user_scores(glovar.user_ids)
+        glovar.high_score_users = glovar.index_high_score_users(glovar.user_scores)
+        result = True
+    except Exception as e:
+        logger.warning(f"Reset user scores error: {e}", exc_info=True)
+    finally:
+        glovar.locks["journal"].release()
+
+    return result
+
+
+def reset_watch_users() -> bool:
+    # Rebuild the watch heap
+    result = False
+
+    glovar.locks["watch"].acquire()
+
+    try:
+        glovar.watch_heap = [] if glovar.database else glovar.index_watch_ids(glovar.watch_ids)
+        result = True
+    except Exception as e:
+        logger.warning(f"Reset watch users error: {e}", exc_info=True)
+    finally:
+        glovar.locks["watch"].release()
+
+    return result
+
+
+def set_trust_group(gid: int, uid_set: Set[int]) -> bool:
+    # Set the group's trust list
+    result = False
+
+    # The index is built in background at startup, trust_ids must not change before it is done
+    resolve_data(glovar.trust_users)
+
+    glovar.locks["trust"].acquire()
+
+    try:
+        old_set = set(glovar.trust_ids.get(gid, set()))
+        glovar.trust_ids[gid] = uid_set
+        update_trust_users(old_set, uid_set)
+        result = save("trust_ids")
+    except Exception as e:
+        logger.warning(f"Set trust group error: {e}", exc_info=True)
+    finally:
+        glovar.locks["trust"].release()
+
+    return result
+
+
+def set_user_score(uid: int, project: str, score: float) -> bool:
+    # Set the user's score of a project
+    result = False
+
+    glovar.locks["journal"].acquire()
+
+    try:
+        glovar.user_ids[uid]["score"][project] = score
+        update_user_score(uid, sum(glovar.user_ids[uid]["score"].values()))
+        result = write_journal("user_ids", "score", uid, project=project, score=score)
+    except Exception as e:
+        logger.warning(f"Set user score error: {e}", exc_info=True)
+    finally:
+        glovar.locks["journal"].release()
+
+    return result
+
+
+def set_watch_user(uid: int, the_type: str, until: int, now: int) -> bool:
+    # Set the user's watch expiry time, return True if watch_ids is changed
+    result = False
+
+    glovar.locks["watch"].acquire()
+
+    try:
+        result = prune_watch_heap(now)
+
+        if glovar.watch_ids[the_type].get(uid) == until:
+            return result
+
+        if until > now:
+            glovar.watch_ids[the_type][uid] = until
+            glovar.database or heappush(resolve_data(glovar.watch_heap), (until, the_type, uid))
+        elif glovar.watch_ids[the_type].pop(uid, None) is None:
+            return result
+
+        save("watch_ids")
+        result = True
+    except Exception as e:
+        logger.warning(f"Set watch user error: {e}", exc_info=True)
+    finally:
+        glovar.locks["watch"].release()
+
+    return result
+
+
+def update_trust_users(old_set: Iterable[int], new_set: Iterable[int]) -> None:
+    # Update the reverse index of trust_ids, should be called with the trust lock
+    old_set = set(old_set)
+    new_set = set(new_set)
+
+    for uid in old_set - new_set:
+        count = glovar.trust_users.get(uid, 0) - 1
+
+        if count > 0:
+            glovar.trust_users[uid] = count
+        else:
+            glovar.trust_users.pop(uid, 0)
+
+    for uid in new_set - old_set:
+        glovar.trust_users[uid] = glovar.trust_users.get(uid, 0) + 1
+
+
+def update_user_score(uid: int, score: float) -> None:
+    # Update the user's total score, should be called with the journal lock
+    if score:
+        glovar.user_scores[uid] = score
+    else:
+        glovar.user_scores.pop(uid, 0.0)
+
+    if score >= glovar.high_score:
+        glovar.high_score_users.add(uid)
+    else:
+        glovar.high_score_users.discard(uid)
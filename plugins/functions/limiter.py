@@ -0,0 +1,139 @@
+# SCP-079-USER - Invite and help other bots
+# Copyright (C) 2019-2023 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-USER.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# This module is imported by glovar, so it must not import glovar
+
+import logging
+from threading import Lock
+from time import monotonic
+from typing import Dict, Hashable, Iterable, List, Optional
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    # A token bucket, the tokens can go negative to reserve the future ones
+
+    __slots__ = ("rate", "capacity", "tokens", "time")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.time = now
+
+    def refill(self, now: float) -> float:
+        # Add the tokens generated since the last refill, return the tokens
+        self.tokens = min(self.capacity, self.tokens + (now - self.time) * self.rate)
+        self.time = now
+
+        return self.tokens
+
+
+class RateLimiter:
+    # A global token bucket and a token bucket per key, a call waits for both of them
+    # The exempt keys only wait for the global bucket, and they are never rejected
+
+    def __init__(self, name: str, global_rate: float, global_burst: float, key_rate: float = 0.0,
+                 key_burst: float = 0.0, max_wait: float = 30.0, size: int = 10000, exempt: Iterable[Hashable] = ()):
+        self.name = name
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+        self.max_wait = max_wait
+        self.exempt = frozenset(exempt)
+        self.size = size
+        self.bucket = TokenBucket(global_rate, global_burst, monotonic())
+        self.buckets: Dict[Hashable, TokenBucket] = {}
+        self.lock = Lock()
+        self.stats = {
+            "calls": 0,
+            "waited": 0,
+            "rejected": 0,
+            "bypassed": 0,
+            "deferred": 0,
+            "wait": 0.0,
+            "wait_max": 0.0
+        }
+
+    def __repr__(self) -> str:
+        return f"<RateLimiter {self.name} {self.bucket.rate}/s {self.key_rate}/s per key>"
+
+    def defer(self) -> None:
+        # Count a call which runs later instead of waiting in its thread
+        with self.lock:
+            self.stats["deferred"] += 1
+
+    def get_text(self) -> str:
+        # Get the stats text
+        with self.lock:
+            stats = dict(self.stats)
+            keys = len(self.buckets)
+
+        wait = stats["wait"] / stats["waited"] * 1000 if stats["waited"] else 0.0
+
+        return (f"{stats['calls']} calls / {stats['waited']} waited / {stats['rejected']} rejected / "
+                f"{stats['bypassed']} bypassed / {stats['deferred']} deferred - "
+                f"{wait:.1f} ms / {stats['wait_max'] * 1000:.1f} ms wait - {keys} keys")
+
+    def prune(self, now: float) -> None:
+        # Drop the buckets that are full again, they are the same as new ones
+        buckets: List[Hashable] = [key for key, bucket in self.buckets.items()
+                                   if bucket.refill(now) >= bucket.capacity]
+
+        for key in buckets:
+            self.buckets.pop(key, None)
+
+    def reserve(self, key: Optional[Hashable] = None, block: bool = True) -> Optional[float]:
+        # Take a token, return the seconds to wait before the call, or None if the wait is too long
+        # If not block, the token is still taken, but the call does not wait and it is not rejected
+        with self.lock:
+            now = monotonic()
+            self.stats["calls"] += 1
+
+            exempt = key in self.exempt
+            buckets = [self.bucket]
+
+            if key is not None and self.key_rate > 0 and not exempt:
+                bucket = self.buckets.get(key)
+
+                if bucket is None:
+                    len(self.buckets) >= self.size and self.prune(now)
+                    bucket = self.buckets[key] = TokenBucket(self.key_rate, self.key_burst, now)
+
+                buckets.append(bucket)
+
+            wait = max(max(0.0, (1 - bucket.refill(now)) / bucket.rate) for bucket in buckets)
+
+            if wait > self.max_wait and block and not exempt:
+                self.stats["rejected"] += 1
+                return None
+
+            for bucket in buckets:
+                bucket.tokens -= 1
+
+            if wait > 0 and not block:
+                self.stats["bypassed"] += 1
+                return 0.0
+
+            if wait > 0:
+                self.stats["waited"] += 1
+                self.stats["wait"] += wait
+                self.stats["wait_max"] = max(self.stats["wait_max"], wait)
+
+        return wait
@@ -19,8 +19,8 @@
 import logging
 import pickle
 from collections import Counter
-from copy import deepcopy
 from json import loads
+from time import perf_counter
 from typing import Any
 
 from pyrogram import Client
@@ -30,10 +30,15 @@ from pyrogram.types import Message
 from .. import glovar
 from .channel import get_debug_text, share_data
 from .decorators import threaded
-from .etc import code, crypt_str, general_link, get_int, get_text, lang, mention_id, thread
-from .file import crypt_file, data_to_file, delete_file, get_new_path, get_downloaded_path, save
+from .etc import code, crypt_str, general_link, get_cache_text, get_executor_text, get_int, get_now, get_stripe_lock
+from .etc import get_limiter_text, get_route_text, get_text, lang, mention_id, thread
+from .file import crypt_file, data_to_file, delete_file, get_new_path, get_downloaded_path, get_save_text, save
+from .file import save_file
+from .filters import get_filter_text
 from .group import delete_messages_globally, delete_messages_from_users, get_config_text, leave_group
-from .ids import init_group_id, init_user_id
+from .ids import add_user_group, clear_users, init_group_id, init_user_id, reset_trust_users, reset_user
+from .ids import remove_watch_user, reset_user_scores, reset_watch_users, set_user_score, set_watch_user
+from .storage import compact_data, import_data, resolve_data
 from .telegram import delete_all_messages, get_admin_log, get_chat_member, promote_chat_member, send_message
 from .telegram import send_report_message
 from .timers import update_admins
@@ -43,6 +48,41 @@ from .user import ban_user_globally, kick_users, unban_user_globally
 logger = logging.getLogger(__name__)
 
 
+def get_parse_text() -> str:
+    # Get the exchange text parse stats text
+    result = ""
+
+    try:
+        stats = glovar.parse_stats
+        parsed = stats["count"] - stats["skipped"]
+        header = stats["header"] / stats["count"] * 1e6 if stats["count"] else 0.0
+        full = stats["full"] / parsed * 1e6 if parsed else 0.0
+        result = (f"{stats['count']} received / {stats['skipped']} skipped - "
+                  f"{header:.1f} us header / {full:.1f} us full parse")
+    except Exception as e:
+        logger.warning(f"Get parse text error: {e}", exc_info=True)
+
+    return result
+
+
+def is_foreign_text(text: str, receiver: str) -> bool:
+    # Check if the exchange text is not sent to the receiver, by scanning its header without decoding it
+    # The header is before the data, which is the last key, any other layout is decoded in full
+    try:
+        data_index = text.find('"data":')
+        to_index = text.find('"to":', 0, data_index)
+        end_index = text.find("]", to_index, data_index)
+
+        if data_index < 0 or to_index < 0 or end_index < 0:
+            return False
+
+        return f'"{receiver}"' not in text[to_index:end_index]
+    except Exception as e:
+        logger.warning(f"Is foreign text error: {e}", exc_info=True)
+
+    return False
+
+
 def receive_add_bad(sender: str, data: dict) -> bool:
     # Receive bad users or channels that other bots shared
     try:
@@ -89,7 +129,6 @@ def receive_add_except(data: dict) -> bool:
 
 def receive_clear_data(client: Client, data_type: str, data: dict) -> bool:
     # Receive clear data command
-    glovar.locks["message"].acquire()
     try:
         # Basic data
         aid = data["admin_id"]
@@ -98,36 +137,32 @@ def receive_clear_data(client: Client, data_type: str, data: dict) -> bool:
         # Clear bad data
         if data_type == "bad":
             if the_type == "channels":
-                glovar.bad_ids["channels"] = set()
+                glovar.bad_ids["channels"].clear()
             elif the_type == "users":
-                glovar.bad_ids["users"] = set()
+                glovar.bad_ids["users"].clear()
 
             save("bad_ids")
 
         # Clear except data
         if data_type == "except":
             if the_type == "channels":
-                glovar.except_ids["channels"] = set()
+                glovar.except_ids["channels"].clear()
 
             save("except_ids")
 
         # Clear user data
         if data_type == "user":
             if the_type == "all":
-                glovar.user_ids = {}
-
-            save("user_ids")
+                clear_users()
 
         # Send debug message
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
                 f"{lang('admin_project')}{lang('colon')}{mention_id(aid)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('clear'))}\n"
                 f"{lang('more')}{lang('colon')}{code(f'{data_type} {the_type}')}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), priority="debug")
     except Exception as e:
         logger.warning(f"Receive clear data: {e}", exc_info=True)
-    finally:
-        glovar.locks["message"].release()
 
     return False
 
@@ -257,7 +292,7 @@ def receive_file_data(client: Client, message: Message, decrypt: bool = True) ->
             data = pickle.load(f)
 
         for f in {path, path_decrypted}:
-            thread(delete_file, (f,))
+            thread(delete_file, (f,), executor="disk")
     except Exception as e:
         logger.warning(f"Receive file error: {e}", exc_info=True)
 
@@ -292,31 +327,22 @@ def receive_flood_score(client: Client, message: Message) -> bool:
     # Receive flood users' score
     result = False
 
-    glovar.locks["message"].acquire()
-
     try:
         users = receive_file_data(client, message)
 
         if users is None:
             return False
 
-        user_list = [uid for uid in list(users) if init_user_id(uid)]
-
-        for uid in user_list:
-            glovar.user_ids[uid]["score"]["captcha"] = users[uid]
-
-        save("user_ids")
+        for uid in list(users):
+            receive_user_score("captcha", {"id": uid, "score": users[uid]})
     except Exception as e:
         logger.warning(f"Receive flood score error: {e}", exc_info=True)
-    finally:
-        glovar.locks["message"].release()
 
     return result
 
 
 def receive_help_ban(client: Client, data: dict) -> bool:
     # Receive help ban request
-    glovar.locks["message"].acquire()
     try:
         # Basic data
         group_id = data["group_id"]
@@ -324,26 +350,29 @@ def receive_help_ban(client: Client, data: dict) -> bool:
         action_type = data["type"]
         should_delete = data["delete"]
 
-        # Init user data
-        if not init_user_id(user_id):
-            return True
+        # Save data under the lock, the requests are sent after the lock is released
+        lock = get_stripe_lock(group_id)
+        lock.acquire()
 
-        # Save data
-        glovar.user_ids[user_id][action_type].add(group_id)
-        save("user_ids")
+        try:
+            # Init user data
+            if not init_user_id(user_id):
+                return True
+
+            add_user_group(user_id, group_id, action_type)
+            delete = glovar.configs[group_id].get("delete") and should_delete
+        finally:
+            lock.release()
 
         # Delete all messages from the user
-        if glovar.configs[group_id].get("delete") and should_delete:
-            thread(delete_all_messages, (client, group_id, user_id))
+        delete and thread(delete_all_messages, (client, group_id, user_id), priority="action")
 
         # Ban globally
-        thread(ban_user_globally, (client, group_id, user_id))
+        thread(ban_user_globally, (client, group_id, user_id), priority="action")
 
         return True
     except Exception as e:
         logger.warning(f"Receive help ban error: {e}", exc_info=True)
-    finally:
-        glovar.locks["message"].release()
 
     return False
 
@@ -414,7 +443,6 @@ def receive_help_confirm(client: Client, data: dict) -> bool:
 
 def receive_help_delete(client: Client, data: dict) -> bool:
     # Receive help delete request
-    glovar.locks["message"].acquire()
     try:
         # Basic data
         group_id = data["group_id"]
@@ -424,16 +452,14 @@ def receive_help_delete(client: Client, data: dict) -> bool:
 
         # Delete all messages from the user
         if action_type == "global":
-            thread(delete_messages_globally, (client, user_id, int(not should_delete) and group_id))
+            thread(delete_messages_globally, (client, user_id, int(not should_delete) and group_id), priority="action")
         elif action_type == "single":
             if glovar.configs[group_id].get("delete") and should_delete:
-                thread(delete_all_messages, (client, group_id, user_id))
+                thread(delete_all_messages, (client, group_id, user_id), priority="action")
 
         return True
     except Exception as e:
         logger.warning(f"Receive help delete error: {e}", exc_info=True)
-    finally:
-        glovar.locks["message"].release()
 
     return False
 
@@ -677,7 +703,7 @@ def receive_leave_approve(client: Client, data: dict) -> bool:
         send_message(client, the_id, info_text)
 
         leave_group(client, the_id)
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), priority="debug")
 
         return True
     except Exception as e:
@@ -699,7 +725,7 @@ def receive_refresh(client: Client, data: int) -> bool:
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
                 f"{lang('admin_project')}{lang('colon')}{mention_id(aid)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('refresh'))}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), priority="debug")
 
         return True
     except Exception as e:
@@ -755,22 +781,21 @@ def receive_remove_except(data: dict) -> bool:
 
 def receive_remove_score(data: int) -> bool:
     # Receive remove user's score
-    glovar.locks["message"].acquire()
-    try:
-        # Basic data
-        uid = data
+    uid = data
+    lock = get_stripe_lock(uid)
+    lock.acquire()
 
+    try:
         if not glovar.user_ids.get(uid):
             return True
 
-        glovar.user_ids[uid] = deepcopy(glovar.default_user_status)
-        save("user_ids")
+        reset_user(uid)
 
         return True
     except Exception as e:
         logger.warning(f"Receive remove score error: {e}", exc_info=True)
     finally:
-        glovar.locks["message"].release()
+        lock.release()
 
     return False
 
@@ -782,9 +807,7 @@ def receive_remove_watch(data: int) -> bool:
         uid = data
 
         # Reset watch status
-        glovar.watch_ids["ban"].pop(uid, 0)
-        glovar.watch_ids["delete"].pop(uid, 0)
-        save("watch_ids")
+        remove_watch_user(uid)
 
         return True
     except Exception as e:
@@ -804,15 +827,32 @@ def receive_rollback(client: Client, message: Message, data: dict) -> bool:
         if not the_data:
             return True
 
-        exec(f"glovar.{the_type} = the_data")
-        save(the_type)
+        if glovar.database and the_type in glovar.storage_list:
+            import_data(glovar.database, the_type, the_data)
+        elif the_type in glovar.journal_list:
+            # Replace the data and write its snapshot, which truncates the journal, under the journal lock
+            with glovar.locks["journal"]:
+                the_data = compact_data(the_type, the_data)
+                exec(f"glovar.{the_type} = the_data")
+                save_file(the_type) or save(the_type)
+        else:
+            the_data = compact_data(the_type, the_data)
+            exec(f"glovar.{the_type} = the_data")
+            save(the_type)
+
+        if the_type == "trust_ids":
+            reset_trust_users()
+        elif the_type == "user_ids":
+            reset_user_scores()
+        elif the_type == "watch_ids":
+            reset_watch_users()
 
         # Send debug message
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
                 f"{lang('admin_project')}{lang('colon')}{mention_id(aid)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('rollback'))}\n"
                 f"{lang('more')}{lang('colon')}{code(the_type)}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), priority="debug")
     except Exception as e:
         logger.warning(f"Receive rollback error: {e}", exc_info=True)
 
@@ -821,16 +861,25 @@ def receive_rollback(client: Client, message: Message, data: dict) -> bool:
 
 def receive_status_ask(client: Client, data: dict) -> bool:
     # Receive version info request
-    glovar.locks["message"].acquire()
     try:
         # Basic data
         aid = data["admin_id"]
         mid = data["message_id"]
 
         group_count = len(glovar.admin_ids)
+        high_score_ids = sorted(resolve_data(glovar.high_score_users))
 
         status = {
-            lang("group_count"): f"{group_count}"
+            lang("cache_stats"): get_cache_text(),
+            lang("executor_stats"): get_executor_text(),
+            lang("filter_stats"): get_filter_text(),
+            lang("group_count"): f"{group_count}",
+            lang("high_score_ids"): high_score_ids,
+            lang("high_score_users"): f"{len(high_score_ids)}",
+            lang("limiter_stats"): get_limiter_text(),
+            lang("parse_stats"): get_parse_text(),
+            lang("route_stats"): get_route_text(),
+            lang("save_stats"): get_save_text()
         }
         file_ = data_to_file(status)
         share_data(
@@ -848,14 +897,12 @@ def receive_status_ask(client: Client, data: dict) -> bool:
         return True
     except Exception as e:
         logger.warning(f"Receive version ask error: {e}", exc_info=True)
-    finally:
-        glovar.locks["message"].release()
 
     return False
 
 
-def receive_text_data(message: Message) -> dict:
-    # Receive text's data from exchange channel
+def receive_text_data(message: Message, receiver: str = "") -> dict:
+    # Receive text's data from exchange channel, the text not sent to the receiver is dropped if it is given
     data = {}
     try:
         text = get_text(message)
@@ -863,7 +910,20 @@ def receive_text_data(message: Message) -> dict:
         if not text:
             return {}
 
+        # Drop the data of other receivers before decoding it
+        stats = glovar.parse_stats
+        start = perf_counter()
+        foreign = receiver and is_foreign_text(text, receiver)
+        middle = perf_counter()
+        stats["count"] += 1
+        stats["header"] += middle - start
+
+        if foreign:
+            stats["skipped"] += 1
+            return {}
+
         data = loads(text)
+        stats["full"] += perf_counter() - middle
     except Exception as e:
         logger.warning(f"Receive text data error: {e}")
 
@@ -872,24 +932,27 @@ def receive_text_data(message: Message) -> dict:
 
 def receive_user_score(project: str, data: dict) -> bool:
     # Receive and update user's score
-    glovar.locks["message"].acquire()
+    lock = None
+
     try:
         # Basic data
         project = project.lower()
         uid = data["id"]
 
+        lock = get_stripe_lock(uid)
+        lock.acquire()
+
         if not init_user_id(uid):
             return True
 
         score = data["score"]
-        glovar.user_ids[uid]["score"][project] = score
-        save("user_ids")
+        set_user_score(uid, project, score)
 
         return True
     except Exception as e:
         logger.warning(f"Receive user score error: {e}", exc_info=True)
     finally:
-        glovar.locks["message"].release()
+        lock and lock.release()
 
     return False
 
@@ -907,14 +970,10 @@ def receive_watch_user(data: dict) -> bool:
         until = get_int(until)
 
         # Add to list
-        if the_type == "ban":
-            glovar.watch_ids["ban"][uid] = until
-        elif the_type == "delete":
-            glovar.watch_ids["delete"][uid] = until
-        else:
+        if the_type not in {"ban", "delete"}:
             return False
 
-        save("watch_ids")
+        set_watch_user(uid, the_type, until, get_now())
 
         return True
     except Exception as e:
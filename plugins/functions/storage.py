@@ -0,0 +1,858 @@
+# SCP-079-USER - Invite and help other bots
+# Copyright (C) 2019-2023 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-USER.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# This module is imported by glovar, so it must not import glovar
+
+import logging
+import sqlite3
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping, MutableSet, Set
+from concurrent.futures import Future
+from contextlib import contextmanager
+from copy import deepcopy
+from itertools import accumulate, islice
+from json import dumps, loads
+from operator import sub
+from threading import Lock, RLock
+from time import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS set_keys (
+    name TEXT,
+    key INTEGER,
+    PRIMARY KEY (name, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS set_members (
+    name TEXT,
+    key INTEGER,
+    member INTEGER,
+    PRIMARY KEY (name, key, member)
+) WITHOUT ROWID;
+DROP INDEX IF EXISTS set_members_member;
+CREATE TABLE IF NOT EXISTS scores (
+    uid INTEGER,
+    project TEXT,
+    score REAL,
+    PRIMARY KEY (uid, project)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS watches (
+    type TEXT,
+    uid INTEGER,
+    until INTEGER,
+    PRIMARY KEY (type, uid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS watches_until ON watches (type, until);
+CREATE TABLE IF NOT EXISTS configs (
+    gid INTEGER PRIMARY KEY,
+    config TEXT
+);
+"""
+
+
+class CompactIdSet(MutableSet):
+    # A set of ids stored as a sorted int64 array, recent changes are kept in small delta sets
+    # The base array has a bucket index of the ids' high bits, so a lookup only bisects a few items
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self.base = ()
+        self.added = set()
+        self.removed = set()
+        self.lock = Lock()
+        self.set_base(sorted(set(ids)))
+
+    def __contains__(self, the_id: Any) -> bool:
+        if the_id in self.added:
+            return True
+
+        if the_id in self.removed:
+            return False
+
+        # Same as in_base, inlined for the lookups of every message
+        base, low, shift, index = self.base
+
+        try:
+            bucket = (the_id - low) >> shift
+        except TypeError:
+            return False
+
+        if not 0 <= bucket < len(index) - 1:
+            return False
+
+        i = bisect_left(base, the_id, index[bucket], index[bucket + 1])
+        return i < index[bucket + 1] and base[i] == the_id
+
+    def __iter__(self) -> Iterator[int]:
+        with self.lock:
+            base, added, removed = self.base[0], list(self.added), set(self.removed)
+
+        return iter([the_id for the_id in base if the_id not in removed] + added)
+
+    def __len__(self) -> int:
+        return len(self.base[0]) - len(self.removed) + len(self.added)
+
+    def __reduce__(self):
+        # Pickled as the deltas of the sorted ids, split into byte planes and compressed
+        ids = array("q", sorted(self)) if self.added or self.removed else self.base[0]
+        deltas = array("q", ids[:1])
+        deltas.extend(map(sub, islice(ids, 1, None), ids))
+        sys.byteorder == "big" and deltas.byteswap()
+        data = deltas.tobytes()
+
+        return self.__class__, (), zlib.compress(b"".join(data[i::8] for i in range(8)))
+
+    def __repr__(self) -> str:
+        return f"CompactIdSet({sorted(self)})"
+
+    def __setstate__(self, state: bytes) -> None:
+        planes = zlib.decompress(state)
+        size = len(planes) // 8
+        data = bytearray(len(planes))
+
+        for i in range(8):
+            data[i::8] = planes[i * size:(i + 1) * size]
+
+        deltas = array("q", data)
+        sys.byteorder == "big" and deltas.byteswap()
+        self.set_base(accumulate(deltas))
+
+    def add(self, the_id: int) -> None:
+        with self.lock:
+            self.removed.discard(the_id)
+
+            if not self.in_base(the_id):
+                self.added.add(the_id)
+
+            self.check_compact()
+
+    def check_compact(self) -> None:
+        # Merge the deltas into the base array when they grow, should be called with the lock
+        if len(self.added) + len(self.removed) <= max(1024, len(self.base[0]) // 64):
+            return
+
+        # Readers check the deltas before the base, so the base must be replaced first
+        self.set_base(sorted([the_id for the_id in self.base[0] if the_id not in self.removed] + list(self.added)))
+        self.added = set()
+        self.removed = set()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.set_base([])
+            self.added = set()
+            self.removed = set()
+
+    def discard(self, the_id: int) -> None:
+        with self.lock:
+            self.added.discard(the_id)
+
+            if self.in_base(the_id):
+                self.removed.add(the_id)
+
+            self.check_compact()
+
+    def in_base(self, the_id: Any) -> bool:
+        # Binary search in the id's bucket of the base array
+        base, low, shift, index = self.base
+
+        try:
+            bucket = (the_id - low) >> shift
+        except TypeError:
+            return False
+
+        if not 0 <= bucket < len(index) - 1:
+            return False
+
+        i = bisect_left(base, the_id, index[bucket], index[bucket + 1])
+        return i < index[bucket + 1] and base[i] == the_id
+
+    def set_base(self, ids: Iterable[int]) -> None:
+        # Replace the base array and its bucket index, the ids must be sorted
+        base = array("q", ids)
+        low = base[0] if base else 0
+        span = base[-1] - low if base else 0
+
+        # About 16 ids in a bucket
+        shift = max(0, span.bit_length() - (len(base) // 16).bit_length())
+        buckets = (span >> shift) + 1
+        index = array("q", [bisect_left(base, low + (bucket << shift)) for bucket in range(buckets)] + [len(base)])
+
+        # A single tuple, so readers never see a base with the index of another one
+        self.base = (base, low, shift, index)
+
+
+class MessageIdWindow:
+    # The recent message ids of a chat, stored as a ring bitmap keyed by the message id
+
+    def __init__(self, size: int = 8192):
+        self.bits = bytearray(size // 8)
+        self.lock = Lock()
+        self.size = size
+        self.top = 0
+
+    def __contains__(self, mid: Any) -> bool:
+        top = self.top
+
+        if not isinstance(mid, int) or not top - self.size < mid <= top:
+            return False
+
+        i = mid % self.size
+
+        return bool(self.bits[i >> 3] & (1 << (i & 7)))
+
+    def __len__(self) -> int:
+        return sum(bin(byte).count("1") for byte in self.bits)
+
+    def __repr__(self) -> str:
+        return f"MessageIdWindow({self.top - self.size + 1}..{self.top})"
+
+    def add(self, mid: int) -> None:
+        with self.lock:
+            if mid <= self.top - self.size:
+                return
+
+            if mid >= self.top + self.size:
+                self.bits = bytearray(self.size // 8)
+            else:
+                # Clear the slots reused by the new ids
+                for the_id in range(self.top + 1, mid + 1):
+                    i = the_id % self.size
+                    self.bits[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+
+            self.top = max(self.top, mid)
+
+            i = mid % self.size
+            self.bits[i >> 3] |= 1 << (i & 7)
+
+
+class Database:
+    # A SQLite connection shared by all threads
+
+    def __init__(self, path: str):
+        self.depth = 0
+        self.lock = RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def execute(self, sql: str, parameters: Iterable = ()) -> List[tuple]:
+        # Execute a statement, get all the rows
+        with self.lock:
+            return self.connection.execute(sql, tuple(parameters)).fetchall()
+
+    def executemany(self, sql: str, parameters: Iterable[Iterable]) -> None:
+        # Execute a statement with many parameters
+        with self.lock:
+            self.connection.executemany(sql, parameters)
+
+    def get_meta(self, name: str) -> Optional[str]:
+        # Get a meta value
+        rows = self.execute("SELECT value FROM meta WHERE name = ?", (name,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, name: str, value: str) -> None:
+        # Set a meta value
+        self.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    @contextmanager
+    def transaction(self):
+        # Run several statements atomically, nested transactions join the outer one
+        with self.lock:
+            if self.depth:
+                self.depth += 1
+
+                try:
+                    yield self
+                finally:
+                    self.depth -= 1
+
+                return
+
+            self.depth = 1
+            self.connection.execute("BEGIN")
+
+            try:
+                yield self
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+            else:
+                self.connection.execute("COMMIT")
+            finally:
+                self.depth = 0
+
+
+class IdSet(MutableSet):
+    # A set of ids stored in the database
+
+    def __init__(self, db: Database, name: str, key: int = 0):
+        self.db = db
+        self.name = name
+        self.key = key
+
+    def __contains__(self, member: Any) -> bool:
+        return bool(self.db.execute("SELECT 1 FROM set_members WHERE name = ? AND key = ? AND member = ?",
+                                    (self.name, self.key, member)))
+
+    def __iter__(self) -> Iterator[int]:
+        rows = self.db.execute("SELECT member FROM set_members WHERE name = ? AND key = ?", (self.name, self.key))
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM set_members WHERE name = ? AND key = ?",
+                               (self.name, self.key))[0][0]
+
+    def __repr__(self) -> str:
+        return repr(set(self))
+
+    def __reduce__(self):
+        return set, (set(self),)
+
+    def __deepcopy__(self, memo: dict) -> set:
+        return set(self)
+
+    def add(self, member: int) -> None:
+        with self.db.transaction():
+            self.db.execute("INSERT OR IGNORE INTO set_keys (name, key) VALUES (?, ?)", (self.name, self.key))
+            self.db.execute("INSERT OR IGNORE INTO set_members (name, key, member) VALUES (?, ?, ?)",
+                            (self.name, self.key, member))
+
+    def clear(self) -> None:
+        self.db.execute("DELETE FROM set_members WHERE name = ? AND key = ?", (self.name, self.key))
+
+    def discard(self, member: int) -> None:
+        self.db.execute("DELETE FROM set_members WHERE name = ? AND key = ? AND member = ?",
+                        (self.name, self.key, member))
+
+    def update(self, members: Iterable[int]) -> None:
+        with self.db.transaction():
+            self.db.execute("INSERT OR IGNORE INTO set_keys (name, key) VALUES (?, ?)", (self.name, self.key))
+            self.db.executemany("INSERT OR IGNORE INTO set_members (name, key, member) VALUES (?, ?, ?)",
+                                [(self.name, self.key, member) for member in members])
+
+
+class IdSetDict(MutableMapping):
+    # A dict of id sets stored in the database, like {-10012345678: {12345678}}
+
+    def __init__(self, db: Database, name: str):
+        self.db = db
+        self.name = name
+
+    def __contains__(self, key: Any) -> bool:
+        return bool(self.db.execute("SELECT 1 FROM set_keys WHERE name = ? AND key = ?", (self.name, key)))
+
+    def __delitem__(self, key: int) -> None:
+        if key not in self:
+            raise KeyError(key)
+
+        with self.db.transaction():
+            self.db.execute("DELETE FROM set_members WHERE name = ? AND key = ?", (self.name, key))
+            self.db.execute("DELETE FROM set_keys WHERE name = ? AND key = ?", (self.name, key))
+
+    def __getitem__(self, key: int) -> IdSet:
+        if key not in self:
+            raise KeyError(key)
+
+        return IdSet(self.db, self.name, key)
+
+    def __iter__(self) -> Iterator[int]:
+        rows = self.db.execute("SELECT key FROM set_keys WHERE name = ?", (self.name,))
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM set_keys WHERE name = ?", (self.name,))[0][0]
+
+    def __repr__(self) -> str:
+        return repr(export_data(self))
+
+    def __setitem__(self, key: int, members: Iterable[int]) -> None:
+        members = list(members)
+
+        with self.db.transaction():
+            self.db.execute("DELETE FROM set_members WHERE name = ? AND key = ?", (self.name, key))
+            self.db.execute("INSERT OR IGNORE INTO set_keys (name, key) VALUES (?, ?)", (self.name, key))
+            self.db.executemany("INSERT INTO set_members (name, key, member) VALUES (?, ?, ?)",
+                                [(self.name, key, member) for member in set(members)])
+
+    def clear(self) -> None:
+        with self.db.transaction():
+            self.db.execute("DELETE FROM set_members WHERE name = ?", (self.name,))
+            self.db.execute("DELETE FROM set_keys WHERE name = ?", (self.name,))
+
+    def pop(self, key: int, *default: Any) -> Any:
+        if key not in self:
+            if default:
+                return default[0]
+
+            raise KeyError(key)
+
+        result = set(self[key])
+        del self[key]
+
+        return result
+
+
+class ScoreDict(MutableMapping):
+    # A user's scores stored in the database, like {"captcha": 0.0}
+
+    def __init__(self, db: Database, uid: int):
+        self.db = db
+        self.uid = uid
+
+    def __delitem__(self, project: str) -> None:
+        self.db.execute("DELETE FROM scores WHERE uid = ? AND project = ?", (self.uid, project))
+
+    def __getitem__(self, project: str) -> float:
+        rows = self.db.execute("SELECT score FROM scores WHERE uid = ? AND project = ?", (self.uid, project))
+
+        if not rows:
+            raise KeyError(project)
+
+        return rows[0][0]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.to_dict())
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM scores WHERE uid = ?", (self.uid,))[0][0]
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+    def __setitem__(self, project: str, score: float) -> None:
+        self.db.execute("INSERT OR REPLACE INTO scores (uid, project, score) VALUES (?, ?, ?)",
+                        (self.uid, project, score))
+
+    def items(self):
+        return self.to_dict().items()
+
+    def to_dict(self) -> Dict[str, float]:
+        # Get all the scores with one query
+        rows = self.db.execute("SELECT project, score FROM scores WHERE uid = ?", (self.uid,))
+        return dict(rows)
+
+    def values(self):
+        return self.to_dict().values()
+
+
+class UserDict(MutableMapping):
+    # Users' status stored in the database, like glovar.user_ids
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def __contains__(self, uid: Any) -> bool:
+        return bool(self.db.execute("SELECT 1 FROM set_keys WHERE name = 'user_ids' AND key = ?", (uid,)))
+
+    def __delitem__(self, uid: int) -> None:
+        if uid not in self:
+            raise KeyError(uid)
+
+        with self.db.transaction():
+            self.delete_user(uid)
+
+    def __getitem__(self, uid: int) -> dict:
+        if uid not in self:
+            raise KeyError(uid)
+
+        return {
+            "ban": IdSet(self.db, "user_ban", uid),
+            "restrict": IdSet(self.db, "user_restrict", uid),
+            "score": ScoreDict(self.db, uid)
+        }
+
+    def __iter__(self) -> Iterator[int]:
+        rows = self.db.execute("SELECT key FROM set_keys WHERE name = 'user_ids'")
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM set_keys WHERE name = 'user_ids'")[0][0]
+
+    def __repr__(self) -> str:
+        return f"<UserDict {len(self)} users>"
+
+    def __setitem__(self, uid: int, status: dict) -> None:
+        with self.db.transaction():
+            self.delete_user(uid)
+            self.insert_user(uid, status)
+
+    def clear(self) -> None:
+        with self.db.transaction():
+            self.db.execute("DELETE FROM set_members WHERE name IN ('user_ban', 'user_restrict')")
+            self.db.execute("DELETE FROM set_keys WHERE name IN ('user_ids', 'user_ban', 'user_restrict')")
+            self.db.execute("DELETE FROM scores")
+
+    def delete_user(self, uid: int) -> None:
+        # Delete a user, should be called in a transaction
+        self.db.execute("DELETE FROM set_members WHERE name IN ('user_ban', 'user_restrict') AND key = ?", (uid,))
+        self.db.execute("DELETE FROM set_keys WHERE name IN ('user_ids', 'user_ban', 'user_restrict') AND key = ?",
+                        (uid,))
+        self.db.execute("DELETE FROM scores WHERE uid = ?", (uid,))
+
+    def get_scores(self) -> Dict[int, float]:
+        # Get the users' total scores with one query, zero scores are not included
+        rows = self.db.execute("SELECT uid, SUM(score) FROM scores GROUP BY uid HAVING SUM(score) != 0")
+        return {row[0]: row[1] for row in rows}
+
+    def insert_user(self, uid: int, status: dict) -> None:
+        # Insert a user, should be called in a transaction
+        self.db.execute("INSERT INTO set_keys (name, key) VALUES ('user_ids', ?)", (uid,))
+
+        for the_type in ["ban", "restrict"]:
+            self.db.execute("INSERT INTO set_keys (name, key) VALUES (?, ?)", (f"user_{the_type}", uid))
+            self.db.executemany("INSERT INTO set_members (name, key, member) VALUES (?, ?, ?)",
+                                [(f"user_{the_type}", uid, gid) for gid in set(status.get(the_type, set()))])
+
+        self.db.executemany("INSERT INTO scores (uid, project, score) VALUES (?, ?, ?)",
+                            [(uid, project, score) for project, score in dict(status.get("score", {})).items()])
+
+
+class WatchDict(MutableMapping):
+    # Watched users stored in the database, like {12345678: 0}
+
+    def __init__(self, db: Database, the_type: str):
+        self.db = db
+        self.type = the_type
+
+    def __delitem__(self, uid: int) -> None:
+        if uid not in self:
+            raise KeyError(uid)
+
+        self.db.execute("DELETE FROM watches WHERE type = ? AND uid = ?", (self.type, uid))
+
+    def __getitem__(self, uid: int) -> int:
+        rows = self.db.execute("SELECT until FROM watches WHERE type = ? AND uid = ?", (self.type, uid))
+
+        if not rows:
+            raise KeyError(uid)
+
+        return rows[0][0]
+
+    def __iter__(self) -> Iterator[int]:
+        rows = self.db.execute("SELECT uid FROM watches WHERE type = ?", (self.type,))
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM watches WHERE type = ?", (self.type,))[0][0]
+
+    def __repr__(self) -> str:
+        return repr(dict(self.items()))
+
+    def __setitem__(self, uid: int, until: int) -> None:
+        self.db.execute("INSERT OR REPLACE INTO watches (type, uid, until) VALUES (?, ?, ?)", (self.type, uid, until))
+
+    def clear(self) -> None:
+        self.db.execute("DELETE FROM watches WHERE type = ?", (self.type,))
+
+    def get_expired(self, now: int) -> List[int]:
+        # Get the expired users, uses the expiry index
+        rows = self.db.execute("SELECT uid FROM watches WHERE type = ? AND until <= ?", (self.type, now))
+        return [row[0] for row in rows]
+
+    def items(self):
+        return dict(self.db.execute("SELECT uid, until FROM watches WHERE type = ?", (self.type,))).items()
+
+
+class ExpiringCache:
+    # A bounded LRU cache, each entry expires after the ttl
+
+    def __init__(self, size: int, ttl: float, stats: Optional[Dict[str, int]] = None):
+        self.data = OrderedDict()
+        self.lock = Lock()
+        self.size = size
+        self.ttl = ttl
+        self.stats = stats if stats is not None else new_cache_stats()
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key, self) is not self
+
+    def __getstate__(self) -> dict:
+        with self.lock:
+            return {"data": OrderedDict(self.data), "size": self.size, "ttl": self.ttl}
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __repr__(self) -> str:
+        return f"<ExpiringCache {len(self)} / {self.size}>"
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["size"], state["ttl"])
+        self.data.update(state["data"])
+
+    def clear(self) -> None:
+        with self.lock:
+            self.data.clear()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        # Get a value, an expired entry is removed and counted as a miss
+        with self.lock:
+            item = self.data.get(key)
+
+            if item is None:
+                self.stats["misses"] += 1
+                return default
+
+            if item[0] <= time():
+                del self.data[key]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return default
+
+            self.data.move_to_end(key)
+            self.stats["hits"] += 1
+
+            return item[1]
+
+    def get_text(self) -> str:
+        # Get the stats text
+        return f"{len(self)} / {self.size} - {get_stats_text(self.stats)}"
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        with self.lock:
+            item = self.data.pop(key, None)
+
+        return default if item is None else item[1]
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None) -> None:
+        # Set a value, the least recently used entries are evicted when the cache is full
+        with self.lock:
+            self.data[key] = (time() + (self.ttl if ttl is None else ttl), value)
+            self.data.move_to_end(key)
+
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+                self.stats["evictions"] += 1
+
+
+class LazyData:
+    # A proxy of a global variable which is being loaded, blocks until the data is ready
+
+    def __init__(self, future: Future):
+        self.future = future
+
+    def __bool__(self) -> bool:
+        return bool(self.future.result())
+
+    def __contains__(self, item: Any) -> bool:
+        return item in self.future.result()
+
+    def __delitem__(self, key: Any) -> None:
+        del self.future.result()[key]
+
+    def __eq__(self, other: Any) -> bool:
+        return self.future.result() == other
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.future.result(), name)
+
+    def __getitem__(self, key: Any) -> Any:
+        return self.future.result()[key]
+
+    def __iter__(self) -> Iterator:
+        return iter(self.future.result())
+
+    def __len__(self) -> int:
+        return len(self.future.result())
+
+    def __reduce_ex__(self, protocol: int):
+        return self.future.result().__reduce_ex__(protocol)
+
+    def __repr__(self) -> str:
+        return repr(self.future.result())
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self.future.result()[key] = value
+
+
+class Config(dict):
+    # A group's config, changes are written back to the database
+
+    def __init__(self, db: Database, gid: int, config: dict):
+        super().__init__(config)
+        self.db = db
+        self.gid = gid
+
+    def __deepcopy__(self, memo: dict) -> dict:
+        return deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        super().__setitem__(key, value)
+        self.db.execute("UPDATE configs SET config = ? WHERE gid = ?", (dumps(dict(self)), self.gid))
+
+
+class ConfigDict(MutableMapping):
+    # Groups' configs stored in the database, like glovar.configs
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def __contains__(self, gid: Any) -> bool:
+        return bool(self.db.execute("SELECT 1 FROM configs WHERE gid = ?", (gid,)))
+
+    def __delitem__(self, gid: int) -> None:
+        if gid not in self:
+            raise KeyError(gid)
+
+        self.db.execute("DELETE FROM configs WHERE gid = ?", (gid,))
+
+    def __getitem__(self, gid: int) -> Config:
+        rows = self.db.execute("SELECT config FROM configs WHERE gid = ?", (gid,))
+
+        if not rows:
+            raise KeyError(gid)
+
+        return Config(self.db, gid, loads(rows[0][0]))
+
+    def __iter__(self) -> Iterator[int]:
+        return iter([row[0] for row in self.db.execute("SELECT gid FROM configs")])
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM configs")[0][0]
+
+    def __repr__(self) -> str:
+        return repr(export_data(self))
+
+    def __setitem__(self, gid: int, config: dict) -> None:
+        self.db.execute("INSERT OR REPLACE INTO configs (gid, config) VALUES (?, ?)", (gid, dumps(dict(config))))
+
+    def clear(self) -> None:
+        self.db.execute("DELETE FROM configs")
+
+
+def compact_data(file: str, data: Any) -> Any:
+    # Use compact id sets in the loaded data
+    if file not in {"bad_ids", "except_ids"} or not isinstance(data, dict):
+        return data
+
+    for key in ["channels", "users"]:
+        if isinstance(data.get(key), Set) and not isinstance(data[key], CompactIdSet):
+            data[key] = CompactIdSet(data[key])
+
+    return data
+
+
+def export_data(data: Any) -> Any:
+    # Convert the data stored in the database to built-in types
+    if isinstance(data, LazyData):
+        return export_data(data.future.result())
+
+    if isinstance(data, Mapping):
+        return {key: export_data(value) for key, value in data.items()}
+
+    if isinstance(data, Set):
+        return set(data)
+
+    return data
+
+
+def get_data(db: Database, file: str) -> Any:
+    # Get the facade of a global variable stored in the database
+    if file in {"admin_ids", "trust_ids"}:
+        return IdSetDict(db, file)
+
+    if file == "bad_ids":
+        return {
+            "channels": IdSet(db, "bad_channels"),
+            "users": IdSet(db, "bad_users")
+        }
+
+    if file == "except_ids":
+        return {
+            "channels": IdSet(db, "except_channels"),
+            "temp": IdSetDict(db, "except_temp")
+        }
+
+    if file == "user_ids":
+        return UserDict(db)
+
+    if file == "watch_ids":
+        return {
+            "ban": WatchDict(db, "ban"),
+            "delete": WatchDict(db, "delete")
+        }
+
+    if file == "configs":
+        return ConfigDict(db)
+
+    raise ValueError(f"{file} is not stored in the database")
+
+
+def get_stats_text(stats: Dict[str, int]) -> str:
+    # Get the cache stats text
+    total = stats["hits"] + stats["misses"]
+    rate = stats["hits"] / total * 100 if total else 0.0
+
+    return (f"{stats['hits']} hits / {stats['misses']} misses / {rate:.1f}% / "
+            f"{stats['evictions']} evictions / {stats['expired']} expired")
+
+
+def import_data(db: Database, file: str, data: Any) -> None:
+    # Replace the global variable's data in the database, used for migration and rollback
+    facade = get_data(db, file)
+
+    with db.transaction():
+        if file in {"bad_ids", "except_ids", "watch_ids"}:
+            for key in facade:
+                facade[key].clear()
+
+                if isinstance(facade[key], IdSet):
+                    facade[key].update(data.get(key, set()))
+                else:
+                    for sub_key, value in data.get(key, {}).items():
+                        facade[key][sub_key] = value
+
+            return
+
+        facade.clear()
+
+        if file == "user_ids":
+            for uid, status in data.items():
+                facade.insert_user(uid, status)
+        else:
+            for key, value in data.items():
+                facade[key] = value
+
+
+def new_cache_stats() -> Dict[str, int]:
+    # Get new cache stats, the stats may be shared by several caches
+    return {
+        "hits": 0,
+        "misses": 0,
+        "evictions": 0,
+        "expired": 0
+    }
+
+
+def resolve_data(data: Any) -> Any:
+    # Get the data behind a lazy proxy, blocks until it is loaded
+    return data.future.result() if isinstance(data, LazyData) else data
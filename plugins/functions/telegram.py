@@ -17,6 +17,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from concurrent.futures import Future
+from functools import partial
 from typing import Iterable, List, Optional, Union
 
 from pyrogram import Client
@@ -35,13 +37,14 @@ from pyrogram.errors import FloodWait, MessageDeleteForbidden, PeerIdInvalid
 from pyrogram.errors import UsernameInvalid, UsernameNotOccupied, UserNotParticipant
 
 from .. import glovar
-from .decorators import retry, threaded
-from .etc import delay, get_int
+from .decorators import limited, retry, threaded, with_async
+from .etc import delay, get_chat_data, get_int, get_now, thread
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
+@with_async()
 def delete_messages(client: Client, cid: int, mids: Iterable[int]) -> Optional[bool]:
     # Delete some messages
     result = None
@@ -50,24 +53,76 @@ def delete_messages(client: Client, cid: int, mids: Iterable[int]) -> Optional[b
         mids = list(mids)
 
         if len(mids) <= 100:
-            return delete_messages_100(client, cid, mids)
+            return (yield partial(delete_messages_100, client, cid, mids))
 
-        mids_list = [mids[i:i + 100] for i in range(0, len(mids), 100)]
-        result = all([isinstance(delete_messages_100(client, cid, mids), int) for mids in mids_list])
+        result = True
+
+        for i in range(0, len(mids), 100):
+            result = isinstance((yield partial(delete_messages_100, client, cid, mids[i:i + 100])), int) and result
     except Exception as e:
         logger.warning(f"Delete messages in {cid} error: {e}", exc_info=True)
 
     return result
 
 
-@retry
+def delete_messages_due(client: Client, cid: int) -> bool:
+    # Delete the chat's messages whose deletion is due, in batches of 100
+    result = False
+
+    try:
+        now = get_now()
+
+        with glovar.locks["deletion"]:
+            deletions = glovar.deletions.get(cid, {})
+            mids = [mid for mid, due in deletions.items() if due <= now]
+
+            for mid in mids:
+                deletions.pop(mid, None)
+
+            not deletions and glovar.deletions.pop(cid, None)
+
+        if not mids:
+            return True
+
+        # Saved by flush_data, file.save can not be imported here
+        with glovar.locks["save"]:
+            glovar.dirty_files.add("deletions")
+
+        result = bool(delete_messages(client, cid, sorted(mids)))
+    except Exception as e:
+        logger.warning(f"Delete messages due in {cid} error: {e}", exc_info=True)
+
+    return result
+
+
+def delete_messages_later(client: Client, cid: int, mids: Iterable[int], secs: int) -> bool:
+    # Delete some messages later, the pending deletions are saved to survive restarts
+    result = False
+
+    try:
+        due = get_now() + secs
+
+        with glovar.locks["deletion"]:
+            glovar.deletions.setdefault(cid, {}).update({mid: due for mid in mids})
+
+        with glovar.locks["save"]:
+            glovar.dirty_files.add("deletions")
+
+        result = bool(delay(secs, delete_messages_due, [client, cid]))
+    except Exception as e:
+        logger.warning(f"Delete messages later in {cid} error: {e}", exc_info=True)
+
+    return result
+
+
+@with_async(retry, limited("delete"))
 def delete_messages_100(client: Client, cid: int, mids: Iterable[int]) -> Optional[bool]:
     # Delete some messages
     result = None
 
     try:
         mids = list(mids)
-        result = client.delete_messages(chat_id=cid, message_ids=mids)
+        result = yield client.delete_messages(chat_id=cid, message_ids=mids)
     except FloodWait as e:
         logger.warning(f"Delete message in {cid} - Sleep for {e.value} second(s)")
         raise e
@@ -79,19 +134,19 @@ def delete_messages_100(client: Client, cid: int, mids: Iterable[int]) -> Option
     return result
 
 
-@retry
+@with_async(retry, limited("delete"))
 def delete_all_messages(client: Client, gid: int, uid: int) -> bool:
     # Delete a user's all messages in a group
     result = False
 
     try:
-        group_id = resolve_peer(client, gid)
-        user_id = resolve_peer(client, uid)
+        group_id = yield partial(resolve_peer, client, gid)
+        user_id = yield partial(resolve_peer, client, uid)
 
         if not group_id or not user_id:
             return False
 
-        result = bool(client.invoke(DeleteParticipantHistory(channel=group_id, participant=user_id))) or True
+        result = bool((yield client.invoke(DeleteParticipantHistory(channel=group_id, participant=user_id)))) or True
     except FloodWait as e:
         logger.warning(f"Sleep for {e.value} seconds in {gid}")
         raise e
@@ -102,6 +157,7 @@ def delete_all_messages(client: Client, gid: int, uid: int) -> bool:
 
 
 @retry
+@limited("query")
 def download_media(client: Client, file_id: str, file_path: str) -> Optional[str]:
     # Download a media file
     result = None
@@ -151,6 +207,7 @@ def get_admin_log(client: Client, cid: int,
 
 
 @retry
+@limited("query")
 def get_admin_log_100(client: Client, peer: InputChannel, query: str, max_id: int,
                       event_filter: ChannelAdminLogEventsFilter, admins: List[InputUser]) -> AdminLogResults:
     result = None
@@ -176,6 +233,7 @@ def get_admin_log_100(client: Client, peer: InputChannel, query: str, max_id: in
 
 
 @retry
+@limited("query")
 def get_admins(client: Client, cid: int) -> Union[bool, List[ChatMember], None]:
     # Get a group's admins
     result = None
@@ -200,6 +258,7 @@ def get_admins(client: Client, cid: int) -> Union[bool, List[ChatMember], None]:
 
 
 @retry
+@limited("query")
 def get_chat(client: Client, cid: Union[int, str]) -> Union[Chat, ChatPreview, None]:
     # Get a chat
     result = None
@@ -217,6 +276,7 @@ def get_chat(client: Client, cid: Union[int, str]) -> Union[Chat, ChatPreview, N
 
 
 @retry
+@limited("query")
 def get_chat_member(client: Client, cid: int, uid: int) -> Union[bool, ChatMember, None]:
     # Get information about one member of a chat
     result = None
@@ -235,6 +295,7 @@ def get_chat_member(client: Client, cid: int, uid: int) -> Union[bool, ChatMembe
 
 
 @retry
+@limited("query")
 def get_common_chats(client: Client, uid: int) -> Optional[List[Chat]]:
     # Get the common chats with a user
 
@@ -262,23 +323,22 @@ def get_group_info(client: Client, chat: Union[int, Chat], cache: bool = True) -
             the_cache = glovar.chats.get(chat)
 
             if cache and the_cache:
-                result = the_cache
+                data = the_cache
             else:
                 result = get_chat(client, chat)
+                data = result and get_chat_data(result)
+                data and glovar.chats.set(chat, data)
+        else:
+            data = get_chat_data(chat)
 
-            if result:
-                glovar.chats[chat] = result
-
-            chat = result
-
-        if not chat:
+        if not data:
             return group_name, group_link
 
-        if chat.title:
-            group_name = chat.title
+        if data["title"]:
+            group_name = data["title"]
 
-        if chat.username:
-            group_link = "https://t.me/" + chat.username
+        if data["username"]:
+            group_link = "https://t.me/" + data["username"]
     except Exception as e:
         logger.warning(f"Get group {chat} info error: {e}", exc_info=True)
 
@@ -286,6 +346,7 @@ def get_group_info(client: Client, chat: Union[int, Chat], cache: bool = True) -
 
 
 @retry
+@limited("query")
 def get_messages(client: Client, cid: int, mids: Union[int, Iterable[int]]) -> Union[Message, List[Message], None]:
     # Get some messages
     result = None
@@ -302,6 +363,7 @@ def get_messages(client: Client, cid: int, mids: Union[int, Iterable[int]]) -> U
     return result
 
 
+@limited("restrict")
 def kick_chat_member(client: Client, cid: int, uid: Union[int, str],
                      until_date: int = 0) -> Union[bool, Message, None]:
     # Kick a chat member in a group
@@ -328,6 +390,7 @@ def kick_chat_member(client: Client, cid: int, uid: Union[int, str],
 
 
 @retry
+@limited("restrict")
 def leave_chat(client: Client, cid: int, delete: bool = False) -> bool:
     # Leave a channel
     result = False
@@ -345,6 +408,7 @@ def leave_chat(client: Client, cid: int, delete: bool = False) -> bool:
 
 
 @retry
+@limited("restrict")
 def promote_chat_member(client: Client, cid: int, uid: Union[int, str],
                         can_manage_chat: bool = False,
                         can_change_info: bool = False,
@@ -386,12 +450,14 @@ def promote_chat_member(client: Client, cid: int, uid: Union[int, str],
 
 
 @retry
+@limited("query")
+@with_async()
 def resolve_peer(client: Client, pid: Union[int, str]) -> Union[bool, InputChannel, InputPeer, InputUser, None]:
     # Get an input peer by id
     result = None
 
     try:
-        result = client.resolve_peer(pid)
+        result = yield client.resolve_peer(pid)
     except FloodWait as e:
         logger.warning(f"Resolve peer {pid} - Sleep for {e.value} second(s)")
         raise e
@@ -417,14 +483,42 @@ def resolve_username(client: Client, username: str, cache: bool = True) -> (str,
         the_cache = glovar.usernames.get(username)
 
         if cache and the_cache:
-            return the_cache["peer_type"], the_cache["peer_id"]
+            return the_cache
 
+        # Only one request for the same username at a time, the others wait for its result
+        with glovar.locks["resolve"]:
+            future = glovar.usernames_resolving.get(username)
+            leader = future is None
+
+            if leader:
+                future = glovar.usernames_resolving[username] = Future()
+
+        if not leader:
+            return future.result(timeout=600)
+
+        try:
+            peer_type, peer_id = resolve_username_peer(client, username)
+        finally:
+            with glovar.locks["resolve"]:
+                glovar.usernames_resolving.pop(username, None)
+
+            future.set_result((peer_type, peer_id))
+    except Exception as e:
+        logger.warning(f"Resolve username {username} error: {e}", exc_info=True)
+
+    return peer_type, peer_id
+
+
+def resolve_username_peer(client: Client, username: str) -> (str, int):
+    # Resolve peer by username without the single-flight, and update the cache
+    peer_type = ""
+    peer_id = 0
+
+    try:
         result = resolve_peer(client, username)
 
-        if not result:
-            glovar.usernames[username] = {}
-            glovar.usernames[username]["peer_type"] = peer_type
-            glovar.usernames[username]["peer_id"] = peer_id
+        # Do not cache other errors
+        if result is None:
             return peer_type, peer_id
 
         if isinstance(result, InputPeerChannel):
@@ -435,17 +529,18 @@ def resolve_username(client: Client, username: str, cache: bool = True) -> (str,
             peer_type = "user"
             peer_id = result.user_id
 
-        glovar.usernames[username] = {
-            "peer_type": peer_type,
-            "peer_id": peer_id
-        }
+        if peer_id:
+            glovar.usernames.set(username, (peer_type, peer_id))
+        else:
+            glovar.usernames.set(username, (peer_type, peer_id), glovar.username_negative_ttl)
     except Exception as e:
-        logger.warning(f"Resolve username {username} error: {e}", exc_info=True)
+        logger.warning(f"Resolve username peer {username} error: {e}", exc_info=True)
 
     return peer_type, peer_id
 
 
 @retry
+@limited("restrict")
 def restrict_chat_member(client: Client, cid: int, uid: int, permissions: ChatPermissions,
                          until_date: int = 0) -> Optional[Chat]:
     # Restrict a user in a supergroup
@@ -465,7 +560,32 @@ def restrict_chat_member(client: Client, cid: int, uid: int, permissions: ChatPe
     return result
 
 
+def resume_deletions(client: Client) -> bool:
+    # Resume the saved pending deletions after a restart, the overdue ones are deleted at once
+    result = False
+
+    try:
+        now = get_now()
+
+        with glovar.locks["deletion"]:
+            deletions = {cid: set(chat.values()) for cid, chat in glovar.deletions.items()}
+
+        for cid, due_set in deletions.items():
+            if min(due_set) <= now:
+                thread(delete_messages_due, (client, cid))
+
+            for due in due_set:
+                due > now and delay(due - now, delete_messages_due, [client, cid])
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Resume deletions error: {e}", exc_info=True)
+
+    return result
+
+
 @retry
+@limited("send")
 def send_document(client: Client, cid: int, document: str, caption: str = "", mid: int = None,
                   markup: Union[InlineKeyboardMarkup, ReplyKeyboardMarkup] = None) -> Union[bool, Message, None]:
     # Send a document to a chat
@@ -492,7 +612,7 @@ def send_document(client: Client, cid: int, document: str, caption: str = "", mi
     return result
 
 
-@retry
+@with_async(retry, limited("send"))
 def send_message(client: Client, cid: int, text: str, mid: int = None,
                  markup: Union[InlineKeyboardMarkup, ReplyKeyboardMarkup] = None) -> Union[bool, Message, None]:
     # Send a message to a chat
@@ -502,7 +622,7 @@ def send_message(client: Client, cid: int, text: str, mid: int = None,
         if not text.strip():
             return None
 
-        result = client.send_message(
+        result = yield client.send_message(
             chat_id=cid,
             text=text,
             parse_mode=ParseMode.HTML,
@@ -523,6 +643,7 @@ def send_message(client: Client, cid: int, text: str, mid: int = None,
 
 
 @retry
+@limited("send")
 def send_photo(client: Client, cid: int, photo: str, caption: str = "", mid: int = None,
                markup: Union[InlineKeyboardMarkup, ReplyKeyboardMarkup] = None) -> Union[bool, Message, None]:
     # Send a photo to a chat
@@ -553,13 +674,15 @@ def send_photo(client: Client, cid: int, photo: str, caption: str = "", mid: int
 
 
 @threaded()
+@with_async()
 def send_report_message(secs: int, client: Client, cid: int, text: str, mid: int = None,
                         markup: InlineKeyboardMarkup = None) -> Optional[bool]:
     # Send a message that will be auto deleted to a chat
     result = None
 
     try:
-        result = send_message(
+        result = yield partial(
+            send_message,
             client=client,
             cid=cid,
             text=text,
@@ -572,7 +695,7 @@ def send_report_message(secs: int, client: Client, cid: int, text: str, mid: int
 
         mid = result.id
         mids = [mid]
-        result = delay(secs, delete_messages, [client, cid, mids])
+        result = delete_messages_later(client, cid, mids, secs)
     except Exception as e:
         logger.warning(f"Send report message to {cid} error: {e}", exc_info=True)
 
@@ -580,6 +703,7 @@ def send_report_message(secs: int, client: Client, cid: int, text: str, mid: int
 
 
 @retry
+@limited("restrict")
 def unban_chat_member(client: Client, cid: int, uid: Union[int, str]) -> Optional[bool]:
     # Unban a user in a group
     result = None
@@ -24,26 +24,38 @@ from pyrogram import Client
 from .. import glovar
 from .channel import share_data
 from .decorators import threaded
-from .etc import code, general_link, lang, thread
-from .file import data_to_file, save
+from .etc import code, general_link, get_now, get_stripe_lock, lang, lock_acquire, lock_release
+from .etc import thread
+from .file import compact_journals, data_to_file, flush_data, save
 from .group import leave_group, save_admins
+from .ids import clear_users, prune_watch_users
+from .storage import export_data
 from .telegram import get_admins, get_group_info, send_message, send_report_message
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
-@threaded()
+@threaded("disk", "debug")
 def backup_files(client: Client) -> bool:
     # Backup data files to BACKUP
     result = False
 
     try:
+        compact_journals()
+        flush_data()
+
         for file in glovar.file_list:
             # Check
             if not eval(f"glovar.{file}"):
                 continue
 
+            # Export the data stored in the database
+            if glovar.database and file in glovar.storage_list:
+                file_ = data_to_file(export_data(eval(f"glovar.{file}")))
+            else:
+                file_ = f"data/{file}"
+
             # Share
             share_data(
                 client=client,
@@ -51,7 +63,7 @@ def backup_files(client: Client) -> bool:
                 action="backup",
                 action_type="data",
                 data=file,
-                file=f"data/{file}"
+                file=file_
             )
             sleep(5)
 
@@ -90,12 +102,22 @@ def interval_min_10(client: Client) -> bool:
     # Execute every 10 minutes
     result = False
 
-    glovar.locks["message"].acquire()
-
     try:
         # Clear recorded users
         for gid in list(glovar.recorded_ids):
-            glovar.recorded_ids[gid] = set()
+            lock = get_stripe_lock(gid)
+            lock.acquire()
+
+            try:
+                glovar.recorded_ids[gid] = set()
+            finally:
+                lock.release()
+
+        # Remove expired watch users
+        prune_watch_users(get_now())
+
+        # Snapshot the caches
+        save("usernames")
 
         # Send /long to LONG
         thread(send_report_message, (10, client, glovar.captcha_group_id, "/long"))
@@ -103,8 +125,6 @@ def interval_min_10(client: Client) -> bool:
         result = True
     except Exception as e:
         logger.warning(f"Interval min 10 error: {e}", exc_info=True)
-    finally:
-        glovar.locks["message"].release()
 
     return result
 
@@ -112,19 +132,18 @@ def interval_min_10(client: Client) -> bool:
 def reset_data(client: Client) -> bool:
     # Reset user data every month
     try:
-        glovar.bad_ids["users"] = set()
+        glovar.bad_ids["users"].clear()
         save("bad_ids")
 
-        glovar.except_ids["temp"] = {}
+        glovar.except_ids["temp"].clear()
         save("except_ids")
 
-        glovar.user_ids = {}
-        save("user_ids")
+        clear_users()
 
         # Send debug message
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('reset'))}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), priority="debug")
 
         return True
     except Exception as e:
@@ -137,7 +156,7 @@ def update_admins(client: Client) -> bool:
     # Update admin list every day
     result = False
 
-    glovar.locks["admin"].acquire()
+    lock_acquire("admin")
 
     try:
         # Basic data
@@ -168,7 +187,7 @@ def update_admins(client: Client) -> bool:
                               f"{lang('group_id')}{lang('colon')}{code(gid)}\n"
                               f"{lang('status')}{lang('colon')}{code(lang('leave_auto'))}\n"
                               f"{lang('reason')}{lang('colon')}{code(lang('reason_leave'))}\n")
-                thread(send_message, (client, glovar.debug_channel_id, debug_text))
+                thread(send_message, (client, glovar.debug_channel_id, debug_text), priority="debug")
                 continue
 
             # Check the admin list
@@ -216,17 +235,18 @@ def update_admins(client: Client) -> bool:
                           f"{lang('group_name')}{lang('colon')}{general_link(group_name, group_link)}\n"
                           f"{lang('group_id')}{lang('colon')}{code(gid)}\n"
                           f"{lang('status')}{lang('colon')}{code(reason)}\n")
-            thread(send_message, (client, glovar.debug_channel_id, debug_text))
+            thread(send_message, (client, glovar.debug_channel_id, debug_text), priority="debug")
 
         result = True
     except Exception as e:
         logger.warning(f"Update admin error: {e}", exc_info=True)
     finally:
-        glovar.locks["admin"].release()
+        lock_release("admin")
 
     return result
 
 
+@threaded(priority="debug")
 def update_status(client: Client, the_type: str) -> bool:
     # Update running status to BACKUP
     result = False
@@ -26,11 +26,12 @@ from pyrogram.types import ChatPermissions, Message, User
 from .. import glovar
 from .channel import forward_evidence, send_debug, share_bad_user
 from .decorators import threaded
-from .etc import code, general_link, get_now, lang, thread
+from .etc import code, general_link, get_now, get_stripe_lock, lang, lock_acquire, lock_release
+from .etc import thread
 from .file import save
 from .filters import is_class_d_user, is_declared_message
 from .group import delete_message
-from .ids import init_group_id, init_user_id
+from .ids import add_user_group, init_group_id, init_user_id, remove_user_group
 from .telegram import delete_all_messages, get_common_chats, get_group_info, kick_chat_member
 from .telegram import restrict_chat_member, send_message, unban_chat_member
 
@@ -55,19 +56,19 @@ def add_bad_user(client: Client, uid: int) -> bool:
     return False
 
 
-@threaded()
+@threaded(priority="action")
 def ban_user(client: Client, gid: int, uid: Union[int, str], lock: bool = False) -> bool:
     # Ban a user
     result = False
 
-    lock and glovar.locks["ban"].acquire()
+    lock and lock_acquire("ban")
 
     try:
         result = kick_chat_member(client, gid, uid)
     except Exception as e:
         logger.warning(f"Ban user error: {e}", exc_info=True)
     finally:
-        lock and glovar.locks["ban"].release()
+        lock and lock_release("ban")
 
     return result
 
@@ -104,9 +105,10 @@ def ban_user_globally(client: Client, gid: int, uid: int) -> bool:
 
             # Global ban
             if glovar.configs[group_id].get("gb"):
-                glovar.user_ids[uid]["ban"].add(group_id)
+                add_user_group(uid, group_id, "ban")
                 ban_user(client, group_id, uid, True)
-                glovar.configs[group_id].get("delete") and thread(delete_all_messages, (client, group_id, uid))
+                glovar.configs[group_id].get("delete") and thread(delete_all_messages, (client, group_id, uid),
+                                                                  priority="action")
                 text += f"{lang('action')}{lang('colon')}{code(lang('gb'))}\n"
 
             # Global restrict
@@ -114,20 +116,22 @@ def ban_user_globally(client: Client, gid: int, uid: int) -> bool:
                 if group_id in glovar.user_ids[uid]["restrict"]:
                     continue
 
-                glovar.user_ids[uid]["restrict"].add(group_id)
+                add_user_group(uid, group_id, "restrict")
                 restrict_user(client, group_id, uid)
-                glovar.configs[group_id].get("delete") and thread(delete_all_messages, (client, group_id, uid))
+                glovar.configs[group_id].get("delete") and thread(delete_all_messages, (client, group_id, uid),
+                                                                  priority="action")
                 text += f"{lang('action')}{lang('colon')}{code(lang('gr'))}\n"
 
             # Global delete
             elif glovar.configs[group_id].get("gd"):
-                glovar.configs[group_id].get("delete") and thread(delete_all_messages, (client, group_id, uid))
+                glovar.configs[group_id].get("delete") and thread(delete_all_messages, (client, group_id, uid),
+                                                                  priority="action")
                 text += f"{lang('action')}{lang('colon')}{code(lang('gd'))}\n"
 
         if len(text.split("\n")) > 2:
             text += (f"{lang('user_id')}{lang('colon')}{code(uid)}\n"
                      f"{lang('rule')}{lang('colon')}{code(lang('rule_custom'))}\n")
-            thread(send_message, (client, glovar.debug_channel_id, text))
+            thread(send_message, (client, glovar.debug_channel_id, text), priority="debug")
 
         return True
     except Exception as e:
@@ -136,7 +140,7 @@ def ban_user_globally(client: Client, gid: int, uid: int) -> bool:
     return False
 
 
-@threaded()
+@threaded(priority="action")
 def kick_user(client: Client, gid: int, uid: Union[int, str]) -> bool:
     # Kick a user
     result = False
@@ -152,7 +156,7 @@ def kick_user(client: Client, gid: int, uid: Union[int, str]) -> bool:
     return result
 
 
-@threaded()
+@threaded(priority="action")
 def kick_users(client: Client, gid: int, uids: Iterable[int]) -> bool:
     # Kick users
     result = False
@@ -172,7 +176,7 @@ def kick_users(client: Client, gid: int, uids: Iterable[int]) -> bool:
     return result
 
 
-@threaded()
+@threaded(priority="action")
 def restrict_user(client: Client, gid: int, uid: Union[int, str]) -> bool:
     # Restrict a user
     result = False
@@ -190,13 +194,15 @@ def restrict_user(client: Client, gid: int, uid: Union[int, str]) -> bool:
 
 def terminate_user(client: Client, message: Message, user: User, the_type: str) -> bool:
     # Delete user's message
+    claimed = False
+    gid = message.chat.id
+    uid = user.id
+
     try:
         # Check if it is necessary
         if is_declared_message(None, None, message):
             return True
 
-        gid = message.chat.id
-        uid = user.id
         mid = message.id
 
         if not is_class_d_user(user):
@@ -208,141 +214,81 @@ def terminate_user(client: Client, message: Message, user: User, the_type: str)
         if not init_user_id(uid):
             return True
 
-        # Subscribe ban
+        # Get the action
         if the_type == "sb":
-            if gid not in glovar.user_ids[uid]["ban"]:
-                result = forward_evidence(
-                    client=client,
-                    message=message,
-                    user=user,
-                    level=lang("auto_ban"),
-                    rule=lang(the_type)
-                )
-
-                if result:
-                    bad and add_bad_user(client, uid)
-                    glovar.user_ids[uid]["ban"].add(gid)
-                    save("user_ids")
-                    ban_user(client, gid, uid)
-                    delete_message(client, gid, mid)
-                    send_debug(
-                        client=client,
-                        chat=message.chat,
-                        action=lang("auto_ban"),
-                        uid=uid,
-                        mid=mid,
-                        em=result
-                    )
-            else:
-                delete_message(client, gid, mid)
-
-        # Subscribe restrict
+            action = "ban"
         elif the_type == "sr":
-            if gid not in glovar.user_ids[uid]["restrict"]:
-                result = forward_evidence(
-                    client=client,
-                    message=message,
-                    user=user,
-                    level=lang("auto_ban"),
-                    rule=lang(the_type)
-                )
-
-                if result:
-                    bad and add_bad_user(client, uid)
-                    glovar.user_ids[uid]["restrict"].add(gid)
-                    save("user_ids")
-                    restrict_user(client, gid, uid)
-                    delete_message(client, gid, mid)
-                    send_debug(
-                        client=client,
-                        chat=message.chat,
-                        action=lang("auto_ban"),
-                        uid=uid,
-                        mid=mid,
-                        em=result
-                    )
-            else:
-                delete_message(client, gid, mid)
-
-        # Subscribe delete
+            action = "restrict"
         elif the_type == "sd":
-            if uid not in glovar.recorded_ids[gid]:
-                result = forward_evidence(
-                    client=client,
-                    message=message,
-                    user=user,
-                    level=lang("auto_delete"),
-                    rule=lang(the_type),
-                    general=bad
-                )
-
-                if result:
-                    bad and add_bad_user(client, uid)
-                    glovar.recorded_ids[gid].add(uid)
-                    delete_message(client, gid, mid)
-                    send_debug(
-                        client=client,
-                        chat=message.chat,
-                        action=lang("auto_delete"),
-                        uid=uid,
-                        mid=mid,
-                        em=result
-                    )
-            else:
-                delete_message(client, gid, mid)
-
-        # Scam
+            action = "delete"
+        elif the_type == "scam" and not user.is_scam and (message.forward_from or message.forward_from_chat):
+            action = "delete"
         elif the_type == "scam":
-            if not user.is_scam and (message.forward_from or message.forward_from_chat):
-                result = forward_evidence(
-                    client=client,
-                    message=message,
-                    user=user,
-                    level=lang("auto_delete"),
-                    rule=lang(the_type)
-                )
-
-                if result:
-                    bad and add_bad_user(client, uid)
-                    glovar.recorded_ids[gid].add(uid)
-                    delete_message(client, gid, mid)
-                    send_debug(
-                        client=client,
-                        chat=message.chat,
-                        action=lang("auto_delete"),
-                        uid=uid,
-                        mid=mid,
-                        em=result
-                    )
-            elif gid not in glovar.user_ids[uid]["ban"]:
-                result = forward_evidence(
-                    client=client,
-                    message=message,
-                    user=user,
-                    level=lang("auto_ban"),
-                    rule=lang(the_type)
-                )
-
-                if result:
-                    bad and add_bad_user(client, uid)
-                    glovar.user_ids[uid]["ban"].add(gid)
-                    save("user_ids")
-                    ban_user(client, gid, uid)
-                    delete_message(client, gid, mid)
-                    send_debug(
-                        client=client,
-                        chat=message.chat,
-                        action=lang("auto_ban"),
-                        uid=uid,
-                        mid=mid,
-                        em=result
-                    )
+            action = "ban"
+        else:
+            return True
+
+        # Claim the user in the group, the requests are sent after the lock is released
+        lock = get_stripe_lock(gid)
+        lock.acquire()
+
+        try:
+            if action in {"ban", "restrict"}:
+                done = gid in glovar.user_ids[uid][action]
+            elif the_type == "sd":
+                done = uid in glovar.recorded_ids[gid]
             else:
-                delete_message(client, gid, mid)
+                done = False
+
+            claimed = not done and (gid, uid) not in glovar.terminating_ids
+            claimed and glovar.terminating_ids.add((gid, uid))
+        finally:
+            lock.release()
+
+        if not claimed:
+            delete_message(client, gid, mid)
+            return True
+
+        # Terminate
+        level = (action == "delete" and lang("auto_delete")) or lang("auto_ban")
+        result = forward_evidence(
+            client=client,
+            message=message,
+            user=user,
+            level=level,
+            rule=lang(the_type),
+            general=(the_type != "sd" or bad)
+        )
+
+        if not result:
+            return True
+
+        bad and add_bad_user(client, uid)
+
+        if action == "ban":
+            add_user_group(uid, gid, "ban")
+            ban_user(client, gid, uid)
+        elif action == "restrict":
+            add_user_group(uid, gid, "restrict")
+            restrict_user(client, gid, uid)
+        else:
+            glovar.recorded_ids[gid].add(uid)
+
+        delete_message(client, gid, mid)
+        send_debug(
+            client=client,
+            chat=message.chat,
+            action=level,
+            uid=uid,
+            mid=mid,
+            em=result
+        )
 
         return True
     except Exception as e:
         logger.warning(f"Terminate user error: {e}", exc_info=True)
+    finally:
+        claimed and glovar.terminating_ids.discard((gid, uid))
 
     return False
 
@@ -350,7 +296,7 @@ def terminate_user(client: Client, message: Message, user: User, the_type: str)
 def unban_user(client: Client, gid: int, uid: int) -> bool:
     # Unban a user
     try:
-        thread(unban_chat_member, (client, gid, uid))
+        thread(unban_chat_member, (client, gid, uid), priority="action")
 
         return True
     except Exception as e:
@@ -366,15 +312,13 @@ def unban_user_globally(client: Client, uid: int) -> bool:
             return True
 
         for gid in list(glovar.user_ids[uid]["ban"]):
-            glovar.user_ids[uid]["ban"].discard(gid)
+            remove_user_group(uid, gid, "ban")
             unban_user(client, gid, uid)
 
         for gid in list(glovar.user_ids[uid]["restrict"]):
-            glovar.user_ids[uid]["restrict"].discard(gid)
+            remove_user_group(uid, gid, "restrict")
             unrestrict_user(client, gid, uid)
 
-        save("user_ids")
-
         return True
     except Exception as e:
         logger.warning(f"Unban user globally error: {e}", exc_info=True)
@@ -395,7 +339,7 @@ def unrestrict_user(client: Client, gid: int, uid: Union[int, str]) -> bool:
             can_invite_users=True,
             can_pin_messages=True
         )
-        thread(restrict_chat_member, (client, gid, uid, permissions))
+        thread(restrict_chat_member, (client, gid, uid, permissions), priority="action")
 
         return True
     except Exception as e:
@@ -18,17 +18,29 @@
 
 import logging
 import pickle
+from asyncio import AbstractEventLoop
+from concurrent.futures import Future, ThreadPoolExecutor
 from configparser import RawConfigParser
-from os import mkdir
+from copy import deepcopy
+from functools import partial
+from heapq import heapify
+from os import _exit, mkdir
 from os.path import exists
 from shutil import rmtree
-from threading import Lock
-from typing import Dict, List, Set, Union
+from struct import Struct
+from threading import Lock, RLock, local
+from time import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 
-from pyrogram.types import Chat, ChatMember
+from .functions.executor import BoundedExecutor, TimerWheel
+from .functions.limiter import RateLimiter
+from .functions.storage import CompactIdSet, Database, ExpiringCache, LazyData, MessageIdWindow, UserDict
+from .functions.storage import compact_data, get_data, import_data, new_cache_stats
 
 SESSION_DIR_PATH = "data/session"
 
+start_time: float = time()
+
 # Enable logging
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -80,12 +92,33 @@ user_channel_id: int = 0
 
 # [custom]
 aio: Union[bool, str] = ""
+async_mode: Union[bool, str] = ""
 backup: Union[bool, str] = ""
+chat_cache_ttl: int = 600
+crypto_queue: int = 100
+crypto_workers: int = 2
 date_reset: str = ""
 default_group_link: str = ""
+disk_queue: int = 1000
+disk_workers: int = 4
+executor_policy: str = "block"
 image_size: int = 0
+member_cache_size: int = 1000
+member_cache_ttl: int = 3600
 project_link: str = ""
 project_name: str = ""
+rate_limit_wait: int = 60
+receive_queue: int = 1000
+receive_shards: int = 8
+save_interval: int = 30
+storage: str = "pickle"
+telegram_queue: int = 1000
+telegram_workers: int = 16
+url_cache_size: int = 10000
+url_cache_ttl: int = 86400
+username_cache_size: int = 10000
+username_cache_ttl: int = 86400
+username_negative_ttl: int = 3600
 zh_cn: Union[bool, str] = ""
 
 # [encrypt]
@@ -136,13 +169,35 @@ try:
     # [custom]
     aio = config["custom"].get("aio", aio)
     aio = eval(aio)
+    async_mode = config["custom"].get("async_mode", "False")
+    async_mode = eval(async_mode)
     backup = config["custom"].get("backup", backup)
     backup = eval(backup)
+    chat_cache_ttl = int(config["custom"].get("chat_cache_ttl", str(chat_cache_ttl)))
+    crypto_queue = int(config["custom"].get("crypto_queue", str(crypto_queue)))
+    crypto_workers = int(config["custom"].get("crypto_workers", str(crypto_workers)))
     date_reset = config["custom"].get("date_reset", date_reset)
     default_group_link = config["custom"].get("default_group_link", default_group_link)
+    disk_queue = int(config["custom"].get("disk_queue", str(disk_queue)))
+    disk_workers = int(config["custom"].get("disk_workers", str(disk_workers)))
+    executor_policy = config["custom"].get("executor_policy", executor_policy)
     image_size = int(config["custom"].get("image_size", str(image_size)))
+    member_cache_size = int(config["custom"].get("member_cache_size", str(member_cache_size)))
+    member_cache_ttl = int(config["custom"].get("member_cache_ttl", str(member_cache_ttl)))
     project_link = config["custom"].get("project_link", project_link)
     project_name = config["custom"].get("project_name", project_name)
+    rate_limit_wait = int(config["custom"].get("rate_limit_wait", str(rate_limit_wait)))
+    receive_queue = int(config["custom"].get("receive_queue", str(receive_queue)))
+    receive_shards = int(config["custom"].get("receive_shards", str(receive_shards)))
+    save_interval = int(config["custom"].get("save_interval", str(save_interval)))
+    storage = config["custom"].get("storage", storage)
+    telegram_queue = int(config["custom"].get("telegram_queue", str(telegram_queue)))
+    telegram_workers = int(config["custom"].get("telegram_workers", str(telegram_workers)))
+    url_cache_size = int(config["custom"].get("url_cache_size", str(url_cache_size)))
+    url_cache_ttl = int(config["custom"].get("url_cache_ttl", str(url_cache_ttl)))
+    username_cache_size = int(config["custom"].get("username_cache_size", str(username_cache_size)))
+    username_cache_ttl = int(config["custom"].get("username_cache_ttl", str(username_cache_ttl)))
+    username_negative_ttl = int(config["custom"].get("username_negative_ttl", str(username_negative_ttl)))
     zh_cn = config["custom"].get("zh_cn", zh_cn)
     zh_cn = eval(zh_cn)
 
@@ -174,12 +229,33 @@ if (prefix == []
         or logging_channel_id == 0
         or test_group_id == 0
         or aio not in {False, True}
+        or async_mode not in {False, True}
         or backup not in {False, True}
+        or chat_cache_ttl <= 0
+        or crypto_queue < 0
+        or crypto_workers <= 0
         or date_reset in {"", "[DATA EXPUNGED]"}
         or default_group_link in {"", "[DATA EXPUNGED]"}
+        or disk_queue < 0
+        or disk_workers <= 0
+        or executor_policy not in {"block", "reject"}
         or image_size == 0
+        or member_cache_size <= 0
+        or member_cache_ttl <= 0
         or project_link in {"", "[DATA EXPUNGED]"}
         or project_name in {"", "[DATA EXPUNGED]"}
+        or rate_limit_wait <= 0
+        or receive_queue < 0
+        or receive_shards <= 0
+        or save_interval <= 0
+        or storage not in {"pickle", "sqlite"}
+        or telegram_queue < 0
+        or telegram_workers <= 0
+        or url_cache_size <= 0
+        or url_cache_ttl <= 0
+        or username_cache_size <= 0
+        or username_cache_ttl <= 0
+        or username_negative_ttl <= 0
         or zh_cn not in {False, True}
         or key in {b"", b"[DATA EXPUNGED]", "", "[DATA EXPUNGED]"}
         or password in {"", "[DATA EXPUNGED]"}):
@@ -204,16 +280,25 @@ lang: Dict[str, str] = {
     "admin_project": (zh_cn and "项目管理员") or "Project Admin",
     # Basic
     "action": (zh_cn and "执行操作") or "Action",
+    "cache_stats": (zh_cn and "缓存统计") or "Cache Stats",
     "clear": (zh_cn and "清空数据") or "Clear Data",
     "colon": (zh_cn and "：") or ": ",
     "description": (zh_cn and "说明") or "Description",
     "disabled": (zh_cn and "禁用") or "Disabled",
     "enabled": (zh_cn and "启用") or "Enabled",
     "error": (zh_cn and "错误") or "Error",
+    "executor_stats": (zh_cn and "线程池统计") or "Executor Stats",
+    "filter_stats": (zh_cn and "过滤统计") or "Filter Stats",
+    "high_score_ids": (zh_cn and "高分用户列表") or "High Score User IDs",
+    "high_score_users": (zh_cn and "高分用户") or "High Score Users",
+    "limiter_stats": (zh_cn and "限速统计") or "Rate Limiter Stats",
+    "parse_stats": (zh_cn and "数据解析统计") or "Parse Stats",
     "reason": (zh_cn and "原因") or "Reason",
     "reset": (zh_cn and "重置数据") or "Reset Data",
     "result": (zh_cn and "结果") or "Result",
     "rollback": (zh_cn and "数据回滚") or "Rollback",
+    "route_stats": (zh_cn and "数据路由统计") or "Route Stats",
+    "save_stats": (zh_cn and "数据保存") or "Data Saves",
     "status_failed": (zh_cn and "未执行") or "Failed",
     "status_succeeded": (zh_cn and "成功执行") or "Succeeded",
     "version": (zh_cn and "版本") or "Version",
@@ -334,18 +419,42 @@ all_commands: List[str] = [
     "white"
 ]
 
+async_stats: Dict[str, int] = {
+    "submitted": 0,
+    "done": 0,
+    "pending_max": 0
+}
+# Coroutines scheduled on the event loop in async mode, the stats are not locked
+
 bot_ids: Set[int] = {avatar_id, captcha_id, clean_id, lang_id, long_id, noflood_id,
                      noporn_id, nospam_id, recheck_id, tip_id, user_id, warn_id}
 
-chats: Dict[int, Chat] = {}
+chats: ExpiringCache = ExpiringCache(10000, 86400)
 # chats = {
-#     -10012345678: Chat
+#     -10012345678: (1512345678.0, {
+#         "title": "SCP-079-TEST",
+#         "username": "SCP_079_TEST",
+#         "description": "lowercased description",
+#         "pinned_text": "lowercased pinned text",
+#         "time": 1512345678.0
+#     })
 # }
+# Refreshed in background after chat_cache_ttl, dropped after a day without use
+
+chats_refreshing: Set[int] = set()
+# chats_refreshing = {-10012345678}
 
-declared_message_ids: Dict[int, Set[int]] = {}
+coroutines: Dict[Callable, Callable] = {}
+# coroutines = {
+#     send_message: send_message
+# }
+# The async mode counterparts of the sync functions, generated by with_async from the same definition
+
+declared_message_ids: Dict[int, MessageIdWindow] = {}
 # declared_message_ids = {
-#     -10012345678: {123}
+#     -10012345678: MessageIdWindow
 # }
+# Only the last message_id_window ids of each group are kept
 
 default_config: Dict[str, Union[bool, int, Dict[str, bool]]] = {
     "default": True,
@@ -375,21 +484,120 @@ default_user_status: Dict[str, Union[Set[int], Dict[str, float]]] = {
     }
 }
 
+dirty_files: Set[str] = set()
+# dirty_files = {"user_ids"}
+
+priorities: Tuple[str, ...] = ("action", "normal", "debug")
+# Enforcement actions run before the evidence and the shared data, which run before the debug messages and backups
+
+executors: Dict[str, BoundedExecutor] = {
+    "crypto": BoundedExecutor("crypto", crypto_workers, crypto_queue, executor_policy, priorities),
+    "disk": BoundedExecutor("disk", disk_workers, disk_queue, executor_policy, priorities),
+    "telegram": BoundedExecutor("telegram", telegram_workers, telegram_queue, executor_policy, priorities)
+}
+# Telegram requests, file operations and file encryption run in these pools
+# A queued task runs regardless of its priority after waiting 10 seconds
+
+filter_stats: Dict[str, Dict[str, int]] = {}
+# filter_stats = {
+#     "is_class_c": {
+#         "count": 4,
+#         "evaluated": 1
+#     }
+# }
+
+first_message_time: float = 0.0
+
+high_score: float = 3.0
+
+high_score_users: Set[int] = set()
+# high_score_users = {12345678}
+# The users whose total score is not less than high_score, listed in the status reply to MANAGE
+
+journal_list: List[str] = ["user_ids"]
+
+journal_projects: List[str] = list(default_user_status["score"])
+# Only append to this list, the index is stored in the journal
+
+journal_struct: Struct = Struct("<BBqqd")
+# journal_struct = (type, project, uid, gid, score)
+
+journal_types: List[str] = ["reset", "score", "ban", "restrict", "unban", "unrestrict", "clear"]
+# Only append to this list, the index is stored in the journal
+
+limit_exempt_ids: Set[int] = {critical_channel_id, debug_channel_id, exchange_channel_id, hide_channel_id,
+                               logging_channel_id, user_channel_id}
+# limit_exempt_ids = {-10012345678}
+
+limiters: Dict[str, RateLimiter] = {
+    "delete": RateLimiter("delete", 30, 30, 5, 20, rate_limit_wait),
+    "query": RateLimiter("query", 30, 30, max_wait=rate_limit_wait),
+    "restrict": RateLimiter("restrict", 20, 20, 3, 10, rate_limit_wait),
+    "send": RateLimiter("send", 25, 30, 20 / 60, 5, rate_limit_wait, exempt=limit_exempt_ids)
+}
+# Calls per second and burst, global and per chat, the calls waiting longer than rate_limit_wait are rejected
+# A group accepts about 20 messages per minute from a bot, the project's own channels only share the global budget
+
+lock_holds: local = local()
+# lock_holds.count = 1
+# The count of the global locks held by the thread, the rate limiters do not sleep while it is positive
+
 locks: Dict[str, Lock] = {
     "admin": Lock(),
     "ban": Lock(),
-    "message": Lock(),
+    "chat": Lock(),
+    "deletion": Lock(),
+    "flush": Lock(),
+    "journal": RLock(),
     "preview": Lock(),
     "receive": Lock(),
-    "test": Lock()
+    "resolve": Lock(),
+    "save": Lock(),
+    "test": Lock(),
+    "trust": Lock(),
+    "watch": Lock()
 }
+# The journal lock is reentrant, a rollback saves the snapshot while holding it
+
+loop: Optional[AbstractEventLoop] = None
+# The client's event loop, set after the client is started
+
+member_stats: Dict[str, int] = new_cache_stats()
+# member_stats = {
+#     "hits": 0,
+#     "misses": 0,
+#     "evictions": 0,
+#     "expired": 0
+# }
+# Shared by the member caches of all groups
 
-members: Dict[int, Dict[int, ChatMember]] = {}
+members: Dict[int, ExpiringCache] = {}
 # members = {
 #     -10012345678: {
-#         12345678: ChatMember
+#         12345678: (1512345678.0, {
+#             "status": ChatMemberStatus.MEMBER,
+#             "can_delete_messages": False,
+#             "can_restrict_members": False
+#         })
 #     }
 # }
+# A failed request is cached as an empty dict
+
+message_id_window: int = 8192
+# The count of the recent message ids kept in declared_message_ids, should be a multiple of 8
+
+parse_stats: Dict[str, Union[int, float]] = {
+    "count": 0,
+    "skipped": 0,
+    "header": 0.0,
+    "full": 0.0
+}
+# The exchange texts received and the ones skipped by their header, the parse time in seconds
+# The stats are not locked, they are only used for the status
+
+receive_executors: List[BoundedExecutor] = [BoundedExecutor(f"receive-{i}", 1, receive_queue, executor_policy)
+                                             for i in range(receive_shards)]
+# The exchange data is processed in order within a group or a user, and in parallel across them
 
 receivers: Dict[str, List[str]] = {
     "bad": ["ANALYZE", "APPLY", "AVATAR", "CAPTCHA", "CLEAN", "LANG", "LONG", "MANAGE",
@@ -405,23 +613,80 @@ recorded_ids: Dict[int, Set[int]] = {}
 #     -10012345678: {12345678}
 # }
 
+route_buckets: List[float] = [0.001, 0.01, 0.1, 1.0, 10.0]
+# The upper bounds of the route latency histogram, in seconds
+
+route_stats: Dict[str, Dict[str, Union[int, float, List[int]]]] = {}
+# route_stats = {
+#     "CAPTCHA help kick": {
+#         "count": 1,
+#         "errors": 0,
+#         "latency": 0.01,
+#         "histogram": [0, 1, 0, 0, 0, 0]
+#     }
+# }
+# The stats are not locked, they are only used for the status
+
+save_stats: Dict[str, Dict[str, Union[int, float]]] = {}
+# save_stats = {
+#     "user_ids": {
+#         "count": 1,
+#         "bytes": 1024,
+#         "latency": 0.01,
+#         "latency_max": 0.01
+#     }
+# }
+
 sender: str = "USER"
 
 should_hide: bool = False
 
-shared_url: Set[str] = set()
-# shared_url = {"scp-079.org"}
+shared_url: ExpiringCache = ExpiringCache(url_cache_size, url_cache_ttl)
+# shared_url = {
+#     "scp-079.org/user": (1512345678.0, True)
+# }
+# The keys are canonical urls, the value is the expiry time and True
 
-usernames: Dict[str, Dict[str, Union[int, str]]] = {}
+trust_users: Dict[int, int] = {}
+# trust_users = {
+#     12345678: 2
+# }
+# The reverse index of trust_ids, the value is the count of the groups
+
+user_scores: Dict[int, float] = {}
+# user_scores = {
+#     12345678: 1.2
+# }
+# The users' total scores, zero scores are not stored
+
+stripe_locks: List[Lock] = [Lock() for _ in range(64)]
+# The locks of groups and users, see etc.get_stripe_lock()
+
+terminating_ids: Set[Tuple[int, int]] = set()
+# terminating_ids = {(-10012345678, 12345678)}
+# The users being terminated in the groups, claimed with the group's stripe lock
+
+timer_wheel: TimerWheel = TimerWheel("timer", 0.5, 1024)
+# All the delayed calls, the due calls are handed over to the worker pools
+
+usernames: ExpiringCache = ExpiringCache(username_cache_size, username_cache_ttl)
 # usernames = {
-#     "SCP_079": {
-#         "peer_type": "channel",
-#         "peer_id": -1001196128009
-#     }
+#     "SCP_079": (1512345678.0, ("channel", -1001196128009))
+# }
+# Failed resolutions are cached as ("", 0) with username_negative_ttl
+
+usernames_resolving: Dict[str, Future] = {}
+# usernames_resolving = {
+#     "SCP_079": Future
 # }
 
 version: str = "0.3.0"
 
+watch_heap: List[Tuple[int, str, int]] = []
+# watch_heap = [(1512345678, "ban", 12345678)]
+# The min-heap of watch_ids ordered by the expiry time, entries replaced in watch_ids are skipped
+# Not used with the SQLite storage, the database index finds the expired entries
+
 # Load data from pickle
 
 # Init dir
@@ -441,17 +706,17 @@ admin_ids: Dict[int, Set[int]] = {}
 #     -10012345678: {12345678}
 # }
 
-bad_ids: Dict[str, Set[int]] = {
-    "channels": set(),
-    "users": set()
+bad_ids: Dict[str, CompactIdSet] = {
+    "channels": CompactIdSet(),
+    "users": CompactIdSet()
 }
 # bad_ids = {
 #     "channels": {-10012345678},
 #     "users": {12345678}
 # }
 
-except_ids: Dict[str, Union[Dict, Set[int]]] = {
-    "channels": set(),
+except_ids: Dict[str, Union[Dict, CompactIdSet]] = {
+    "channels": CompactIdSet(),
     "temp": {}
 }
 # except_ids = {
@@ -514,28 +779,204 @@ configs: Dict[int, Dict[str, Union[bool, int, Dict[str, bool]]]] = {}
 #         "subscribe": True
 # }
 
+deletions: Dict[int, Dict[int, int]] = {}
+# deletions = {
+#     -10012345678: {
+#         123: 1512345678
+#     }
+# }
+# The pending deletions of the bot's own messages, message id: due time
+
 # Load data
 file_list: List[str] = ["admin_ids", "bad_ids", "except_ids", "lack_group_ids", "left_group_ids",
                         "trust_ids", "user_ids", "watch_ids",
                         "configs"]
 
-for file in file_list:
-    try:
+file_priority: List[str] = ["configs", "admin_ids", "bad_ids", "trust_ids", "except_ids", "watch_ids",
+                            "lack_group_ids", "left_group_ids", "user_ids", "usernames", "deletions"]
+# Small and hot data first, user_ids is the largest one, the caches are not backed up
+
+storage_list: List[str] = ["admin_ids", "bad_ids", "except_ids", "trust_ids", "user_ids", "watch_ids", "configs"]
+
+database: Optional[Database] = None
+database_migrated: bool = False
+
+
+def load_file(file: str, default: Any) -> Any:
+    # Load a global variable from the newest readable generation
+    start = time()
+
+    # The current generation first, then the previous one
+    generation_list = [path for path in [f"data/{file}", f"data/.{file}"] if exists(path)]
+
+    if not generation_list:
+        with open(f"data/{file}", "wb") as f:
+            pickle.dump(default, f)
+
+        return default
+
+    for path in generation_list:
         try:
-            if exists(f"data/{file}") or exists(f"data/.{file}"):
-                with open(f"data/{file}", "rb") as f:
-                    locals()[f"{file}"] = pickle.load(f)
-            else:
-                with open(f"data/{file}", "wb") as f:
-                    pickle.dump(eval(f"{file}"), f)
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+
+            break
         except Exception as e:
-            logger.error(f"Load data {file} error: {e}", exc_info=True)
+            logger.error(f"Load data {path} error: {e}", exc_info=True)
+    else:
+        raise ValueError(f"Load data {file} backup error: no generation can be loaded")
+
+    if file == "user_ids":
+        replay_journal(data)
+
+    data = compact_data(file, data)
+
+    # The cache options may be changed since the last save
+    if isinstance(data, ExpiringCache) and isinstance(default, ExpiringCache):
+        data.size = default.size
+        data.ttl = default.ttl
+
+    logger.warning(f"Load data {file} in {time() - start:.3f} second(s)")
+
+    return data
+
+
+def index_high_score_users(data: Dict[int, float]) -> Set[int]:
+    # Build the set of high score users from user_scores
+    return {uid for uid, score in list(data.items()) if score >= high_score}
+
+
+def index_trust_ids(data: Dict[int, Set[int]]) -> Dict[int, int]:
+    # Build the reverse index of trust_ids
+    result = {}
+
+    # Iterate over snapshots, the receivers may change the data while it is indexed in background
+    for uid_set in list(data.values()):
+        for uid in list(uid_set):
+            result[uid] = result.get(uid, 0) + 1
+
+    return result
+
+
+def index_user_scores(data: Dict[int, Dict[str, Union[Set[int], Dict[str, float]]]]) -> Dict[int, float]:
+    # Build the users' total scores from user_ids
+    if isinstance(data, UserDict):
+        return data.get_scores()
 
-            with open(f"data/.{file}", "rb") as f:
-                locals()[f"{file}"] = pickle.load(f)
+    result = {}
+
+    # Iterate over snapshots, the receivers may change the data while it is indexed in background
+    for uid, status in list(data.items()):
+        score = sum(list(status["score"].values()))
+
+        if score:
+            result[uid] = score
+
+    return result
+
+
+def index_watch_ids(data: Dict[str, Dict[int, int]]) -> List[Tuple[int, str, int]]:
+    # Build the expiry heap of watch_ids
+    result = [(until, the_type, uid) for the_type in ["ban", "delete"] for uid, until in list(data[the_type].items())]
+    heapify(result)
+
+    return result
+
+
+def load_file_done(file: str, future: Future) -> None:
+    # Replace the lazy proxy with the loaded data, unless it is replaced already, e.g. by a rollback
+    try:
+        result = future.result()
+
+        if getattr(globals()[file], "future", None) is future:
+            globals()[file] = result
     except Exception as e:
-        logger.critical(f"Load data {file} backup error: {e}", exc_info=True)
-        raise SystemExit("[DATA CORRUPTION]")
+        logger.critical(f"Load data {file} error: {e}", exc_info=True)
+        print("[DATA CORRUPTION]")
+        _exit(1)
+
+
+def replay_journal(data: Dict[int, Dict[str, Union[Set[int], Dict[str, float]]]]) -> None:
+    # Replay the user_ids journal
+    if not exists("data/user_ids.journal"):
+        return
+
+    with open("data/user_ids.journal", "rb") as f:
+        journal_data = f.read()
+
+    # A torn record at the end is ignored
+    for record in journal_struct.iter_unpack(journal_data[:len(journal_data) // journal_struct.size
+                                                         * journal_struct.size]):
+        journal_type = journal_types[record[0]]
+        journal_uid = record[2]
+        journal_gid = record[3]
+
+        if journal_type == "clear":
+            data.clear()
+            continue
+
+        if journal_type == "reset" or data.get(journal_uid) is None:
+            data[journal_uid] = deepcopy(default_user_status)
+
+        if journal_type == "score":
+            data[journal_uid]["score"][journal_projects[record[1]]] = record[4]
+        elif journal_type in {"ban", "restrict"}:
+            data[journal_uid][journal_type].add(journal_gid)
+        elif journal_type in {"unban", "unrestrict"}:
+            data[journal_uid][journal_type[2:]].discard(journal_gid)
+
+
+try:
+    if storage == "sqlite":
+        database = Database("data/database.db")
+        database_migrated = bool(database.get_meta("migrated"))
+
+    if database and not database_migrated:
+        # One-shot migration from the pickles
+        for file in storage_list:
+            import_data(database, file, load_file(file, eval(f"{file}")))
+
+        database.set_meta("migrated", "1")
+        database_migrated = True
+
+    if database:
+        for file in storage_list:
+            locals()[f"{file}"] = get_data(database, file)
+except Exception as e:
+    logger.critical(f"Load database error: {e}", exc_info=True)
+    raise SystemExit("[DATA CORRUPTION]")
+
+# Load the pickles in background while the client is connecting,
+# the first access to a variable blocks until it is loaded
+load_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="load")
+
+for file in file_priority:
+    if database and file in storage_list:
+        continue
+
+    load_future = load_executor.submit(load_file, file, eval(f"{file}"))
+    locals()[f"{file}"] = LazyData(load_future)
+    load_future.add_done_callback(partial(load_file_done, file))
+
+if database:
+    trust_users = index_trust_ids(trust_ids)
+    user_scores = index_user_scores(user_ids)
+    high_score_users = index_high_score_users(user_scores)
+    # The expired watches are found by the database index
+    watch_heap = []
+else:
+    for file, index, data in [("trust_users", index_trust_ids, trust_ids),
+                              ("user_scores", index_user_scores, user_ids),
+                              ("watch_heap", index_watch_ids, watch_ids)]:
+        load_future = load_executor.submit(index, data)
+        locals()[f"{file}"] = LazyData(load_future)
+        load_future.add_done_callback(partial(load_file_done, file))
+
+    load_future = load_executor.submit(index_high_score_users, user_scores)
+    high_score_users = LazyData(load_future)
+    load_future.add_done_callback(partial(load_file_done, "high_score_users"))
+
+load_executor.shutdown(wait=False)
 
 # Start program
 copyright_text = (f"SCP-079-{sender} v{version}, Copyright (C) 2019-2023 SCP-079 <https://scp-079.org>\n"
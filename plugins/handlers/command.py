@@ -26,13 +26,14 @@ from pyrogram.types import Message
 
 from .. import glovar
 from ..functions.channel import get_debug_text, share_data
-from ..functions.etc import code, delay, code_block, general_link, get_command_context, get_command_type, get_int
+from ..functions.etc import code, code_block, general_link, get_command_context, get_command_type, get_int
 from ..functions.etc import get_now, get_readable_time, get_stripped_link, lang, mention_id, thread
 from ..functions.file import save
 from ..functions.filters import authorized_group, captcha_group, from_user, is_class_c, test_group
 from ..functions.group import delete_message, get_config_text
-from ..functions.ids import init_user_id
-from ..functions.telegram import get_group_info, get_messages, resolve_username, send_message, send_report_message
+from ..functions.ids import init_user_id, remove_user_group
+from ..functions.telegram import delete_messages_later, get_group_info, get_messages, resolve_username, send_message
+from ..functions.telegram import send_report_message
 from ..functions.user import unban_user, unrestrict_user
 
 # Enable logging
@@ -96,14 +97,14 @@ def config(client: Client, message: Message) -> bool:
         text = get_debug_text(client, message.chat)
         text += (f"{lang('admin_group')}{lang('colon')}{code(message.from_user.id)}\n"
                  f"{lang('action')}{lang('colon')}{code(lang('config_create'))}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), priority="debug")
 
         return True
     except Exception as e:
         logger.warning(f"Config error: {e}", exc_info=True)
     finally:
         if is_class_c(None, None, message):
-            delay(3, delete_message, [client, gid, mid])
+            delete_messages_later(client, gid, [mid], 3)
         else:
             delete_message(client, gid, mid)
 
@@ -203,7 +204,7 @@ def config_directly(client: Client, message: Message) -> bool:
             debug_text += (f"{lang('admin_group')}{lang('colon')}{code(message.from_user.id)}\n"
                            f"{lang('action')}{lang('colon')}{code(lang('config_change'))}\n"
                            f"{lang('more')}{lang('colon')}{code(f'{command_type} {command_context}')}\n")
-            thread(send_message, (client, glovar.debug_channel_id, debug_text))
+            thread(send_message, (client, glovar.debug_channel_id, debug_text), priority="debug")
 
         text += (f"{lang('action')}{lang('colon')}{code(lang('config_change'))}\n"
                  f"{lang('status')}{lang('colon')}{code(reason)}\n")
@@ -428,10 +429,10 @@ def white(client: Client, message: Message) -> bool:
 
                 # Unban the user
                 if gid in glovar.user_ids[uid]["ban"]:
-                    glovar.user_ids[uid]["ban"].discard(gid)
+                    remove_user_group(uid, gid, "ban")
                     unban_user(client, gid, uid)
                 elif gid in glovar.user_ids[uid]["restrict"]:
-                    glovar.user_ids[uid]["restrict"].discard(gid)
+                    remove_user_group(uid, gid, "restrict")
                     unrestrict_user(client, gid, uid)
 
                 text += (f"{lang('action')}{lang('colon')}{code(lang('action_white'))}\n"
@@ -443,7 +444,7 @@ def white(client: Client, message: Message) -> bool:
                 debug_text += (f"{lang('user_id')}{lang('colon')}{code(uid)}\n"
                                f"{lang('admin_group')}{lang('colon')}{code(aid)}\n"
                                f"{lang('action')}{lang('colon')}{code(lang('action_white'))}\n")
-                thread(send_message, (client, glovar.debug_channel_id, debug_text))
+                thread(send_message, (client, glovar.debug_channel_id, debug_text), priority="debug")
             elif gid in glovar.except_ids["temp"][uid]:
                 # Remove except
                 glovar.except_ids["temp"][uid].discard(gid)
@@ -458,7 +459,7 @@ def white(client: Client, message: Message) -> bool:
                 debug_text += (f"{lang('user_id')}{lang('colon')}{code(uid)}\n"
                                f"{lang('admin_group')}{lang('colon')}{code(aid)}\n"
                                f"{lang('action')}{lang('colon')}{code(lang('action_undo_white'))}\n")
-                thread(send_message, (client, glovar.debug_channel_id, debug_text))
+                thread(send_message, (client, glovar.debug_channel_id, debug_text), priority="debug")
             else:
                 text += (f"{lang('action')}{lang('colon')}{code(lang('action_white'))}\n"
                          f"{lang('status')}{lang('colon')}{code(lang('status_failed'))}\n"
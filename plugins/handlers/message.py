@@ -18,6 +18,9 @@
 
 import logging
 import re
+from bisect import bisect_left
+from time import time
+from typing import Callable, Dict, List, Tuple
 
 from PIL import Image
 from pyrogram import Client, filters
@@ -25,14 +28,15 @@ from pyrogram.types import Message, WebPage
 
 from .. import glovar
 from ..functions.channel import get_debug_text, share_data
-from ..functions.etc import code, delay, general_link, get_channel_link, get_stripped_link, get_text, get_now, lang
-from ..functions.etc import mention_id, thread
+from ..functions.etc import code, general_link, get_channel_link, get_stripped_link, get_now, lang
+from ..functions.etc import get_canonical_url, lock_acquire, lock_release, mention_id, thread
 from ..functions.file import data_to_file, delete_file, get_downloaded_path, save
 from ..functions.filters import aio, authorized_group, captcha_group, class_c, class_d, class_e, declared_message
-from ..functions.filters import exchange_channel, from_user, hide_channel, is_class_d_user, is_declared_message
+from ..functions.filters import exchange_channel, first_message, from_user, hide_channel, is_class_d_user
+from ..functions.filters import is_declared_message
 from ..functions.filters import is_friend_username, is_high_score_user, is_not_allowed, is_watch_user
 from ..functions.filters import new_group, test_group
-from ..functions.group import delete_message, get_description, get_pinned, leave_group, save_admins
+from ..functions.group import delete_message, get_description, get_pinned_text, leave_group, save_admins
 from ..functions.ids import init_group_id
 from ..functions.receive import receive_add_bad, receive_add_except, receive_clear_data, receive_config_commit
 from ..functions.receive import receive_config_reply, receive_config_show, receive_declared_message
@@ -41,7 +45,7 @@ from ..functions.receive import receive_help_delete, receive_help_kick, receive_
 from ..functions.receive import receive_leave_approve, receive_refresh, receive_remove_bad, receive_remove_except
 from ..functions.receive import receive_remove_score, receive_remove_watch, receive_rollback, receive_status_ask
 from ..functions.receive import receive_text_data, receive_user_score, receive_watch_user
-from ..functions.telegram import get_admins, get_group_info, send_message
+from ..functions.telegram import delete_messages_later, get_admins, get_group_info, send_message
 from ..functions.tests import preview_test
 from ..functions.timers import backup_files
 from ..functions.user import terminate_user
@@ -49,6 +53,56 @@ from ..functions.user import terminate_user
 # Enable logging
 logger = logging.getLogger(__name__)
 
+# The routes of the exchange data, (sender, action, type): (handler, arguments, lock)
+# Every sender's permissions are listed explicitly, "*" matches any type
+# The routes with the lock are run one at a time, the others handle their own concurrency
+route_list: List[Tuple[str, str, str, Callable, Tuple[str, ...], bool]] = [
+    ("CAPTCHA", "flood", "delete", receive_flood_delete, ("client", "message", "data"), True),
+    ("CAPTCHA", "flood", "score", receive_flood_score, ("client", "message"), True),
+    ("CAPTCHA", "help", "confirm", receive_help_confirm, ("client", "data"), False),
+    ("CAPTCHA", "help", "delete", receive_help_delete, ("client", "data"), False),
+    ("CAPTCHA", "help", "kick", receive_help_kick, ("client", "message", "data"), True),
+    ("CAPTCHA", "help", "log", receive_help_log, ("client", "data"), False),
+    ("CAPTCHA", "update", "declare", receive_declared_message, ("data",), False),
+    ("CAPTCHA", "update", "score", receive_user_score, ("sender", "data"), False),
+
+    ("CONFIG", "config", "commit", receive_config_commit, ("data",), True),
+    ("CONFIG", "config", "reply", receive_config_reply, ("client", "data"), False),
+
+    ("MANAGE", "add", "bad", receive_add_bad, ("sender", "data"), True),
+    ("MANAGE", "add", "except", receive_add_except, ("data",), True),
+    ("MANAGE", "backup", "now", backup_files, ("client",), True),
+    ("MANAGE", "backup", "rollback", receive_rollback, ("client", "message", "data"), True),
+    ("MANAGE", "clear", "*", receive_clear_data, ("client", "action_type", "data"), True),
+    ("MANAGE", "config", "show", receive_config_show, ("client", "data"), False),
+    ("MANAGE", "invite", "try", receive_invite_try, ("client", "data"), True),
+    ("MANAGE", "leave", "approve", receive_leave_approve, ("client", "data"), True),
+    ("MANAGE", "remove", "bad", receive_remove_bad, ("client", "sender", "data"), True),
+    ("MANAGE", "remove", "except", receive_remove_except, ("data",), True),
+    ("MANAGE", "remove", "score", receive_remove_score, ("data",), True),
+    ("MANAGE", "remove", "watch", receive_remove_watch, ("data",), True),
+    ("MANAGE", "status", "ask", receive_status_ask, ("client", "data"), False),
+    ("MANAGE", "update", "refresh", receive_refresh, ("client", "data"), True),
+
+    ("WARN", "help", "delete", receive_help_delete, ("client", "data"), False)
+]
+
+# The detection bots share the same permissions, NOSPAM does not share watch users
+for bot in ["CLEAN", "LANG", "LONG", "NOFLOOD", "NOPORN", "NOSPAM"]:
+    route_list += [
+        (bot, "add", "bad", receive_add_bad, ("sender", "data"), True),
+        (bot, "help", "ban", receive_help_ban, ("client", "data"), False),
+        (bot, "help", "delete", receive_help_delete, ("client", "data"), False),
+        (bot, "update", "declare", receive_declared_message, ("data",), False),
+        (bot, "update", "score", receive_user_score, ("sender", "data"), False)
+    ]
+    bot != "NOSPAM" and route_list.append((bot, "add", "watch", receive_watch_user, ("data",), False))
+
+routes: Dict[Tuple[str, str, str], Tuple[Callable, Tuple[str, ...], bool]] = {
+    (sender, action, action_type): (handler, arguments, lock)
+    for sender, action, action_type, handler, arguments, lock in route_list
+}
+
 
 @Client.on_message(filters.incoming & filters.group & ~filters.new_chat_members
                    & ~captcha_group & ~test_group & authorized_group
@@ -56,7 +110,6 @@ logger = logging.getLogger(__name__)
                    & ~declared_message)
 def check(client: Client, message: Message) -> bool:
     # Check messages from groups
-    glovar.locks["message"].acquire()
     try:
         # Not allowed message
         detection = is_not_allowed(message)
@@ -67,8 +120,6 @@ def check(client: Client, message: Message) -> bool:
         return True
     except Exception as e:
         logger.warning(f"Check error: {e}", exc_info=True)
-    finally:
-        glovar.locks["message"].release()
 
     return False
 
@@ -79,7 +130,6 @@ def check(client: Client, message: Message) -> bool:
                    & ~declared_message)
 def check_join(client: Client, message: Message) -> bool:
     # Check new joined user
-    glovar.locks["message"].acquire()
     try:
         for new in message.new_chat_members:
             # Check if the user is Class D personnel
@@ -94,8 +144,6 @@ def check_join(client: Client, message: Message) -> bool:
         return True
     except Exception as e:
         logger.warning(f"Check join error: {e}", exc_info=True)
-    finally:
-        glovar.locks["message"].release()
 
     return False
 
@@ -108,8 +156,6 @@ def check_scam(client: Client, message: Message) -> bool:
     # Check scam user
     result = False
 
-    glovar.locks["message"].acquire()
-
     try:
         # Basic data
         gid = message.chat.id
@@ -127,8 +173,6 @@ def check_scam(client: Client, message: Message) -> bool:
         result = terminate_user(client, message, message.from_user, "scam")
     except Exception as e:
         logger.warning(f"Check scam error: {e}", exc_info=True)
-    finally:
-        glovar.locks["message"].release()
 
     return result
 
@@ -146,7 +190,7 @@ def delete_service(client: Client, message: Message) -> bool:
 
         # Check if the message is sent by SCP-079
         if uid == glovar.user_id:
-            delay(10, delete_message, [client, gid, mid])
+            delete_messages_later(client, gid, [mid], 10)
         elif uid in glovar.bot_ids:
             delete_message(client, gid, mid)
 
@@ -163,7 +207,7 @@ def exchange_emergency(client: Client, message: Message) -> bool:
     # Sent emergency channel transfer request
     try:
         # Read basic information
-        data = receive_text_data(message)
+        data = receive_text_data(message, "EMERGENCY")
 
         if not data:
             return True
@@ -193,7 +237,7 @@ def exchange_emergency(client: Client, message: Message) -> bool:
         text = (f"{lang('project')}{lang('colon')}{project_text}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('transfer_channel'))}\n"
                 f"{lang('emergency_channel')}{lang('colon')}{code(hide_text)}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), priority="debug")
 
         return True
     except Exception as e:
@@ -210,7 +254,7 @@ def init_group(client: Client, message: Message) -> bool:
     # Initiate new groups
     result = False
 
-    glovar.locks["admin"].acquire()
+    lock_acquire("admin")
 
     try:
         # Basic data
@@ -236,7 +280,7 @@ def init_group(client: Client, message: Message) -> bool:
             else:
                 text += f"{lang('inviter')}{lang('colon')}{code(inviter.id)}\n"
 
-            return thread(send_message, (client, glovar.debug_channel_id, text))
+            return thread(send_message, (client, glovar.debug_channel_id, text), priority="debug")
 
         if ((is_class_d_user(inviter)
              or is_watch_user(inviter, "ban", now)
@@ -256,7 +300,7 @@ def init_group(client: Client, message: Message) -> bool:
             else:
                 text += f"{lang('inviter')}{lang('colon')}{code(inviter.id)}\n"
 
-            return thread(send_message, (client, glovar.debug_channel_id, text))
+            return thread(send_message, (client, glovar.debug_channel_id, text), priority="debug")
 
         # Remove the left status
         if gid in glovar.left_group_ids:
@@ -296,17 +340,35 @@ def init_group(client: Client, message: Message) -> bool:
             text += f"{lang('inviter')}{lang('colon')}{code(inviter.id)}\n"
 
         # Send debug message
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), priority="debug")
 
         result = True
     except Exception as e:
         logger.warning(f"Init group error: {e}", exc_info=True)
     finally:
-        glovar.locks["admin"].release()
+        lock_release("admin")
 
     return result
 
 
+@Client.on_message(first_message, group=-2)
+def log_first_message(client: Client, message: Message) -> bool:
+    # Log the time to the first handled message
+    try:
+        if glovar.first_message_time:
+            return True
+
+        glovar.first_message_time = time()
+        logger.warning(f"Time to first handled message: "
+                       f"{glovar.first_message_time - glovar.start_time:.3f} second(s)")
+
+        return True
+    except Exception as e:
+        logger.warning(f"Log first message error: {e}", exc_info=True)
+
+    return False
+
+
 @Client.on_message((filters.incoming | aio) & filters.channel
                    & ~filters.command(glovar.all_commands, glovar.prefix)
                    & exchange_channel)
@@ -314,10 +376,8 @@ def process_data(client: Client, message: Message) -> bool:
     # Process the data in exchange channel
     result = False
 
-    glovar.locks["receive"].acquire()
-
     try:
-        data = receive_text_data(message)
+        data = receive_text_data(message, glovar.sender)
 
         if not data:
             return False
@@ -327,221 +387,73 @@ def process_data(client: Client, message: Message) -> bool:
         action = data["action"]
         action_type = data["type"]
         data = data["data"]
-        
-        # This will look awkward,
-        # seems like it can be simplified,
-        # but this is to ensure that the permissions are clear,
-        # so it is intentionally written like this
-        if glovar.sender in receivers:
-
-            if sender == "CAPTCHA":
-
-                if action == "flood":
-                    if action_type == "delete":
-                        receive_flood_delete(client, message, data)
-                    elif action_type == "score":
-                        receive_flood_score(client, message)
-
-                if action == "help":
-                    if action_type == "confirm":
-                        receive_help_confirm(client, data)
-                    elif action_type == "delete":
-                        receive_help_delete(client, data)
-                    elif action_type == "kick":
-                        receive_help_kick(client, message, data)
-                    elif action_type == "log":
-                        receive_help_log(client, data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "CLEAN":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(sender, data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "help":
-                    if action_type == "ban":
-                        receive_help_ban(client, data)
-                    elif action_type == "delete":
-                        receive_help_delete(client, data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "CONFIG":
-
-                if action == "config":
-                    if action_type == "commit":
-                        receive_config_commit(data)
-                    elif action_type == "reply":
-                        receive_config_reply(client, data)
-
-            elif sender == "LANG":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(sender, data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "help":
-                    if action_type == "ban":
-                        receive_help_ban(client, data)
-                    elif action_type == "delete":
-                        receive_help_delete(client, data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "LONG":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(sender, data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "help":
-                    if action_type == "ban":
-                        receive_help_ban(client, data)
-                    elif action_type == "delete":
-                        receive_help_delete(client, data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "MANAGE":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(sender, data)
-                    elif action_type == "except":
-                        receive_add_except(data)
-
-                elif action == "backup":
-                    if action_type == "now":
-                        backup_files(client)
-                    elif action_type == "rollback":
-                        receive_rollback(client, message, data)
-
-                elif action == "clear":
-                    receive_clear_data(client, action_type, data)
-
-                elif action == "config":
-                    if action_type == "show":
-                        receive_config_show(client, data)
-
-                elif action == "invite":
-                    if action_type == "try":
-                        receive_invite_try(client, data)
-
-                elif action == "leave":
-                    if action_type == "approve":
-                        receive_leave_approve(client, data)
-
-                elif action == "remove":
-                    if action_type == "bad":
-                        receive_remove_bad(client, sender, data)
-                    elif action_type == "except":
-                        receive_remove_except(data)
-                    elif action_type == "score":
-                        receive_remove_score(data)
-                    elif action_type == "watch":
-                        receive_remove_watch(data)
-
-                elif action == "status":
-                    if action_type == "ask":
-                        receive_status_ask(client, data)
-
-                elif action == "update":
-                    if action_type == "refresh":
-                        receive_refresh(client, data)
-
-            elif sender == "NOFLOOD":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(sender, data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "help":
-                    if action_type == "ban":
-                        receive_help_ban(client, data)
-                    elif action_type == "delete":
-                        receive_help_delete(client, data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "NOPORN":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(sender, data)
-                    elif action_type == "watch":
-                        receive_watch_user(data)
-
-                elif action == "help":
-                    if action_type == "ban":
-                        receive_help_ban(client, data)
-                    elif action_type == "delete":
-                        receive_help_delete(client, data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "NOSPAM":
-
-                if action == "add":
-                    if action_type == "bad":
-                        receive_add_bad(sender, data)
-
-                elif action == "help":
-                    if action_type == "ban":
-                        receive_help_ban(client, data)
-                    elif action_type == "delete":
-                        receive_help_delete(client, data)
-
-                elif action == "update":
-                    if action_type == "declare":
-                        receive_declared_message(data)
-                    elif action_type == "score":
-                        receive_user_score(sender, data)
-
-            elif sender == "WARN":
-
-                if action == "help":
-                    if action_type == "delete":
-                        receive_help_delete(client, data)
 
-        result = True
+        if glovar.sender not in receivers:
+            return True
+
+        route = routes.get((sender, action, action_type)) or routes.get((sender, action, "*"))
+
+        if not route:
+            return True
+
+        handler, arguments, lock = route
+        values = {
+            "client": client,
+            "message": message,
+            "sender": sender,
+            "action_type": action_type,
+            "data": data
+        }
+        args = [values[argument] for argument in arguments]
+        name = f"{sender} {action} {action_type}"
+
+        # Keep the order within a group or a user, the data without them is ordered by the sender
+        if isinstance(data, int) and not isinstance(data, bool):
+            key = data
+        else:
+            key = isinstance(data, dict) and (data.get("group_id") or data.get("user_id") or data.get("id"))
+
+        key = key or sender
+        executor = glovar.receive_executors[hash(key) % len(glovar.receive_executors)]
+
+        result = executor.submit(process_route, (name, handler, args, lock)) is not None
     except Exception as e:
         logger.warning(f"Process data error: {e}", exc_info=True)
-    finally:
-        glovar.locks["receive"].release()
+
+    return result
+
+
+def process_route(name: str, handler: Callable, args: list, lock: bool) -> bool:
+    # Run the handler of a route, record the stats
+    result = False
+
+    try:
+        stats = glovar.route_stats.get(name)
+
+        if stats is None:
+            stats = glovar.route_stats[name] = {"count": 0, "errors": 0, "latency": 0.0,
+                                                "histogram": [0] * (len(glovar.route_buckets) + 1)}
+
+        start = time()
+
+        lock and lock_acquire("receive")
+
+        # Many handlers return False for normal no-ops, so only an exception counts as an error
+        try:
+            handler(*args)
+            result = True
+        except Exception as e:
+            logger.warning(f"Process route {name} handler error: {e}", exc_info=True)
+        finally:
+            lock and lock_release("receive")
+
+        latency = time() - start
+        stats["count"] += 1
+        stats["errors"] += not result
+        stats["latency"] += latency
+        stats["histogram"][bisect_left(glovar.route_buckets, latency)] += 1
+    except Exception as e:
+        logger.warning(f"Process route {name} error: {e}", exc_info=True)
 
     return result
 
@@ -552,7 +464,7 @@ def process_data(client: Client, message: Message) -> bool:
                    & ~declared_message)
 def share_preview(client: Client, message: Message) -> bool:
     # Share the message's preview with other bots
-    glovar.locks["preview"].acquire()
+    lock_acquire("preview")
     try:
         # Basic data
         gid = message.chat.id
@@ -571,15 +483,15 @@ def share_preview(client: Client, message: Message) -> bool:
         }
 
         url = web_page.url
+        canonical_url = get_canonical_url(url)
 
-        if url in glovar.shared_url:
+        if canonical_url in glovar.shared_url:
             return True
 
         # Bypass prepare
         link = web_page.display_url.lower()
-        description = get_description(client, gid).lower()
-        pinned_message = get_pinned(client, gid)
-        pinned_text = get_text(pinned_message).lower()
+        description = get_description(client, gid)
+        pinned_text = get_pinned_text(client, gid)
 
         # Bypass
         bypass = get_stripped_link(get_channel_link(message))
@@ -613,7 +525,7 @@ def share_preview(client: Client, message: Message) -> bool:
                 return True
             elif image_path:
                 preview["image"] = Image.open(image_path)
-                thread(delete_file, (image_path,))
+                thread(delete_file, (image_path,), executor="disk")
 
         # Store text
         text = ""
@@ -657,13 +569,13 @@ def share_preview(client: Client, message: Message) -> bool:
             },
             file=file_
         )
-        glovar.shared_url.add(url)
+        glovar.shared_url.set(canonical_url, True)
 
         return True
     except Exception as e:
         logger.warning(f"Share preview error: {e}", exc_info=True)
     finally:
-        glovar.locks["preview"].release()
+        lock_release("preview")
 
     return False
 
@@ -674,7 +586,7 @@ def share_preview(client: Client, message: Message) -> bool:
                    & from_user)
 def test(client: Client, message: Message) -> bool:
     # Show test results in TEST group
-    glovar.locks["test"].acquire()
+    lock_acquire("test")
     try:
         preview_test(client, message)
 
@@ -682,6 +594,6 @@ def test(client: Client, message: Message) -> bool:
     except Exception as e:
         logger.warning(f"Test error: {e}", exc_info=True)
     finally:
-        glovar.locks["test"].release()
+        lock_release("test")
 
     return False
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# SCP-079-USER - Invite and help other bots
+# Copyright (C) 2019-2023 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-USER.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Run from the directory with config.ini: python -m unittest discover tests
+
+import unittest
+from types import SimpleNamespace
+
+from plugins import glovar
+from plugins.handlers.message import process_data
+from tests.test_receive import get_message
+
+
+class ShardStub:
+    # A receive shard which records the routes submitted to it
+
+    def __init__(self, submitted: list, index: int):
+        self.submitted = submitted
+        self.index = index
+
+    def submit(self, task, args: tuple = (), kwargs: dict = None, priority: str = None) -> bool:
+        self.submitted.append((self.index, args[0]))
+        return True
+
+
+class TestProcessData(unittest.TestCase):
+
+    def setUp(self):
+        self.executors = glovar.receive_executors
+        self.submitted = []
+        glovar.receive_executors = [ShardStub(self.submitted, i) for i in range(8)]
+
+    def tearDown(self):
+        glovar.receive_executors = self.executors
+
+    def test_watch_order(self):
+        # Add and remove watch of one user come from different senders, they must share a shard
+        uid = 12345678
+        watch = {"id": uid, "type": "ban", "until": "encrypted"}
+        messages = [
+            get_message("CLEAN", [glovar.sender], "add", "watch", watch),
+            get_message("MANAGE", [glovar.sender], "remove", "watch", uid),
+            get_message("NOFLOOD", [glovar.sender], "add", "watch", watch),
+            get_message("MANAGE", [glovar.sender], "remove", "watch", uid)
+        ]
+
+        for message in messages:
+            self.assertTrue(process_data(SimpleNamespace(), message))
+
+        self.assertEqual([name for _, name in self.submitted],
+                         ["CLEAN add watch", "MANAGE remove watch", "NOFLOOD add watch", "MANAGE remove watch"])
+        self.assertEqual(len({index for index, _ in self.submitted}), 1)
+
+    def test_bool_data(self):
+        # A bool payload is not an id, it is ordered by the sender
+        message = get_message("MANAGE", [glovar.sender], "backup", "now", True)
+        self.assertTrue(process_data(SimpleNamespace(), message))
+        self.assertEqual(self.submitted, [(hash("MANAGE") % 8, "MANAGE backup now")])
+
+
+if __name__ == "__main__":
+    unittest.main()
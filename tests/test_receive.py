@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# SCP-079-USER - Invite and help other bots
+# Copyright (C) 2019-2023 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-USER.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Run from the directory with config.ini: python -m unittest discover tests
+
+import unittest
+from html import unescape
+from types import SimpleNamespace
+
+from plugins import glovar
+from plugins.functions.channel import format_data
+from plugins.functions.receive import receive_text_data
+
+
+def get_message(sender: str, receivers: list, action: str, action_type: str, data=None) -> SimpleNamespace:
+    # Get an exchange message as received, the text of the code block
+    text = format_data(sender, receivers, action, action_type, data)
+    text = unescape(text[len("<pre>"):-len("</pre>")])
+
+    return SimpleNamespace(text=text, caption=None)
+
+
+class TestReceiveTextData(unittest.TestCase):
+
+    def test_emergency(self):
+        message = get_message("MANAGE", ["EMERGENCY"], "backup", "hide", True)
+        skipped = glovar.parse_stats["skipped"]
+        data = receive_text_data(message, "EMERGENCY")
+        self.assertEqual(data["to"], ["EMERGENCY"])
+        self.assertIs(data["data"], True)
+        self.assertEqual(glovar.parse_stats["skipped"], skipped)
+
+    def test_foreign(self):
+        message = get_message("NOSPAM", ["CAPTCHA", "CLEAN"], "update", "score", {"id": 12345678, "score": 1.2})
+        skipped = glovar.parse_stats["skipped"]
+        self.assertEqual(receive_text_data(message, glovar.sender), {})
+        self.assertEqual(glovar.parse_stats["skipped"], skipped + 1)
+
+    def test_own(self):
+        message = get_message("NOSPAM", ["CAPTCHA", glovar.sender], "update", "declare",
+                              {"group_id": -10012345678, "message_id": 123})
+        data = receive_text_data(message, glovar.sender)
+        self.assertEqual(data["data"]["message_id"], 123)
+
+    def test_other_layout(self):
+        message = SimpleNamespace(text='{"data": 1, "from": "MANAGE", "to": ["EMERGENCY"], '
+                                       '"action": "backup", "type": "hide"}', caption=None)
+        self.assertEqual(receive_text_data(message, glovar.sender)["data"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# SCP-079-USER - Invite and help other bots
+# Copyright (C) 2019-2023 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-USER.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Run from the directory with config.ini: python -m unittest discover tests
+
+import pickle
+import unittest
+from array import array
+from types import SimpleNamespace
+
+from plugins.functions.storage import CompactIdSet
+
+
+class TestCompactIdSet(unittest.TestCase):
+
+    def setUp(self):
+        self.ids = {-1001234567890, -100, 0, 7, 12345678, 987654321, 7123456789} | set(range(1000, 5000, 3))
+
+    def test_lookup(self):
+        compact = CompactIdSet(self.ids)
+        self.assertEqual(len(compact), len(self.ids))
+
+        for the_id in range(-200, 6000):
+            self.assertEqual(the_id in compact, the_id in self.ids)
+
+        self.assertNotIn(-1001234567891, compact)
+        self.assertNotIn(7123456790, compact)
+        self.assertNotIn("7", compact)
+
+    def test_changes(self):
+        compact = CompactIdSet(self.ids)
+
+        for the_id in range(0, 3000):
+            compact.add(the_id)
+            self.ids.add(the_id)
+
+        for the_id in range(2000, 4000):
+            compact.discard(the_id)
+            self.ids.discard(the_id)
+
+        self.assertEqual(set(compact), self.ids)
+        self.assertEqual(len(compact), len(self.ids))
+
+    def test_pickle(self):
+        compact = CompactIdSet(self.ids)
+        compact.add(42)
+        compact.discard(7)
+        self.ids = (self.ids | {42}) - {7}
+        self.assertEqual(set(pickle.loads(pickle.dumps(compact))), self.ids)
+        self.assertEqual(set(pickle.loads(pickle.dumps(CompactIdSet()))), set())
+
+    def test_legacy_pickle(self):
+        # The older version was pickled as the sorted array of the ids
+        legacy = SimpleNamespace(__reduce__=lambda: (CompactIdSet, (array("q", sorted(self.ids)),)))
+        self.assertEqual(set(pickle.loads(pickle.dumps(legacy))), self.ids)
+
+
+if __name__ == "__main__":
+    unittest.main()